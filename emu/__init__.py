@@ -0,0 +1,93 @@
+# emu - run the pico side (main.py, ssd1306.py, lcd128.py) with a normal python on linux.
+#
+#   import emu
+#   emu.install()   # before importing any of the pico code
+#   import ssd1306, main
+#
+# install() puts stand-ins for the MicroPython-only modules (framebuf, machine, micropython,
+# network, wifi_settings) from emu/mp on the front of sys.path, adds the MicroPython parts of
+# time (sleep_ms, ticks_ms, ticks_diff...) and socket.readinto. _thread, select, socket and
+# struct are the real CPython ones.
+# python -m emu.bench measures drawing cost and i2c traffic per frame.
+#
+import os
+import socket
+import sys
+import time
+import zlib
+import struct
+
+MP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mp')
+
+# MicroPython's ticks wrap at 2**30
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def ticks_ms():
+    return int(time.monotonic() * 1000) & TICKS_MAX
+
+
+def ticks_us():
+    return int(time.monotonic() * 1000000) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def install():
+    '''Make the pico code importable, safe to call more than once'''
+    if MP_DIR not in sys.path:
+        sys.path.insert(0, MP_DIR)
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_cpu = ticks_us
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    if not hasattr(socket.socket, 'readinto'):
+        # MicroPython sockets are streams, CPython's call it recv_into
+        socket.socket.readinto = lambda self, buf: self.recv_into(buf)
+
+
+def to_gray(fbuf, scale=1):
+    '''Rows of 8 bit gray pixels (0 or 255) from anything with width, height and pixel()'''
+    rows = []
+    for y in range(fbuf.height):
+        row = bytearray()
+        for x in range(fbuf.width):
+            row += (b'\xff' if fbuf.pixel(x, y) else b'\x00') * scale
+        for i in range(scale):
+            rows.append(bytes(row))
+    return rows
+
+
+def dump_pgm(fbuf, path, scale=1):
+    '''Write a framebuffer (or SSD1306, or panel framebuffer) as a binary PGM'''
+    rows = to_gray(fbuf, scale)
+    with open(path, 'wb') as f:
+        f.write('P5\n{} {}\n255\n'.format(fbuf.width * scale, fbuf.height * scale).encode())
+        for row in rows:
+            f.write(row)
+
+
+def dump_png(fbuf, path, scale=1):
+    '''Write a framebuffer as an 8 bit grayscale PNG, no extra packages needed'''
+    rows = to_gray(fbuf, scale)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    raw = b''.join(b'\x00' + row for row in rows)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', fbuf.width * scale, fbuf.height * scale, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 9)))
+        f.write(chunk(b'IEND', b''))
@@ -0,0 +1,143 @@
+# bench.py - measure what a frame costs on the display side, on linux.
+#
+#   python -m emu.bench [--frames 200] [--dump frame.png]
+#
+# Drives the real display_updater thread from main.py with a random walk of metrics and
+# compares it with the old way (fill, redraw everything, send the whole buffer).
+# I2C bytes, transactions and bus time at 400kHz are exact. Draw times are CPython's and only
+# useful for comparing one version with another, the pico is a lot slower.
+#
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+import emu
+
+emu.install()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import machine  # noqa: E402  (emu/mp)
+import main  # noqa: E402
+import ssd1306  # noqa: E402
+from emu.panel import SSD1306Panel  # noqa: E402
+
+
+def random_walk(count, seed=1):
+    '''Plausible looking metric snapshots, values in main.metrics slot order'''
+    rng = random.Random(seed)
+    cpu, ram, disk, gpu, vram = 20.0, 8.0, 0.0, 5.0, 2000.0
+    for i in range(count):
+        cpu = min(100.0, max(0.0, cpu + rng.uniform(-8, 8)))
+        ram = min(31.0, max(1.0, ram + rng.uniform(-0.2, 0.2)))
+        disk = max(0.0, disk + rng.uniform(-5e6, 5e6)) if rng.random() < 0.3 else 0.0
+        gpu = min(100.0, max(0.0, gpu + rng.uniform(-10, 10)))
+        vram = min(12282.0, max(0.0, vram + rng.uniform(-200, 200)))
+        yield (cpu, ram, 31.3, disk, gpu, vram, 12282.0)
+
+
+def make_display():
+    i2c = machine.I2C(0, freq=main.C_FREQ)
+    panel = SSD1306Panel()
+    i2c.attach(0x3C, panel)
+    display = ssd1306.SSD1306_I2C(128, 64, i2c)
+    return i2c, panel, display
+
+
+class Result:
+    def __init__(self, name, frames, draw_time, i2c):
+        self.name = name
+        self.frames = frames
+        self.draw_ms = draw_time * 1000 / frames
+        self.bytes = i2c.bytes_written / frames
+        self.transactions = i2c.transactions / frames
+        self.bus_ms = i2c.bus_time() * 1000 / frames
+
+    def row(self):
+        return '{:<12} {:>8.3f} {:>10.1f} {:>8.1f} {:>9.2f}'.format(
+            self.name, self.draw_ms, self.bytes, self.transactions, self.bus_ms)
+
+
+def bench_updater(snapshots):
+    '''main.display_updater as it runs on the pico, one published snapshot per frame'''
+    i2c, panel, display = make_display()
+    main.C_FRAME_TIME = 0
+    shown = threading.Semaphore(0)
+    draw_time = [0.0]
+    real_show = display.show
+    started = [0.0]
+
+    def show(full=False):
+        real_show(full)
+        draw_time[0] += time.perf_counter() - started[0]
+        shown.release()
+
+    display.show = show
+    # the static layer is drawn when the thread starts, count it separately
+    started[0] = time.perf_counter()
+    threading.Thread(target=main.display_updater, args=(display,), daemon=True).start()
+    time.sleep(0.2)
+    i2c.reset_counters()
+    draw_time[0] = 0.0
+
+    for values in snapshots:
+        for i in range(len(values)):
+            main.metrics[i] = values[i]
+        started[0] = time.perf_counter()
+        main.publish()
+        shown.acquire()
+    return Result('incremental', len(snapshots), draw_time[0], i2c), panel, display
+
+
+def bench_full(snapshots):
+    '''The old frame: clear, draw everything, send all 1024 bytes'''
+    i2c, panel, display = make_display()
+    i2c.reset_counters()
+    draw_time = 0.0
+    for values in snapshots:
+        start = time.perf_counter()
+        display.fill(0)
+        for row in range(len(main.C_BAR_LABELS)):
+            display.text(main.C_BAR_LABELS[row], 0, main.C_TEXT_VERTSPACE * row)
+        main.draw_bar_graph(display, values[main.M_CPU] - 1, main.C_BAR_STARTX, 0, main.C_BAR_WIDTH, main.C_BAR_HEIGHT, True)
+        main.draw_bar_graph(display, values[main.M_RAM] / values[main.M_RAM_TOTAL] * 100 - 1, main.C_BAR_STARTX,
+                            main.C_TEXT_VERTSPACE, main.C_BAR_WIDTH, main.C_BAR_HEIGHT, True)
+        main.draw_bar_graph(display, values[main.M_GPU], main.C_BAR_STARTX, main.C_TEXT_VERTSPACE * 2,
+                            main.C_BAR_WIDTH, main.C_BAR_HEIGHT, True)
+        main.draw_bar_graph(display, values[main.M_VRAM] / values[main.M_VRAM_TOTAL] * 100 - 1, main.C_BAR_STARTX,
+                            main.C_TEXT_VERTSPACE * 3, main.C_BAR_WIDTH, main.C_BAR_HEIGHT, True)
+        display.text('Disk: ' + str(int(values[main.M_DISK] / 1024)), 0, main.C_TEXT_VERTSPACE * 4)
+        display.show(full=True)
+        draw_time += time.perf_counter() - start
+    return Result('full', len(snapshots), draw_time, i2c), panel, display
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Benchmark drawing and i2c cost per frame')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dump', help='write the last incremental frame, as seen by the panel, to this .png or .pgm')
+    args = parser.parse_args()
+
+    snapshots = list(random_walk(args.frames, args.seed))
+    full, _, _ = bench_full(snapshots)
+    incremental, panel, display = bench_updater(snapshots)
+
+    print('{:<12} {:>8} {:>10} {:>8} {:>9}'.format('', 'draw ms', 'i2c bytes', 'i2c txn', 'bus ms'))
+    print(full.row())
+    print(incremental.row())
+    # the panel must have ended up with exactly what the driver drew
+    print('panel matches framebuffer:', bytes(panel.ram) == bytes(display.buffer))
+
+    if args.dump:
+        if args.dump.endswith('.pgm'):
+            emu.dump_pgm(panel.framebuffer(), args.dump, 4)
+        else:
+            emu.dump_png(panel.framebuffer(), args.dump, 4)
+        print('wrote', args.dump)
+
+
+if __name__ == '__main__':
+    main_bench()
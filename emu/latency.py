@@ -0,0 +1,213 @@
+# latency.py - end to end benchmark, from psutil sampling in pc_server to pixels on the
+# emulated display.
+#
+#   python -m emu.latency [--seconds 10] [--mode asyncio] [--delta] [--async] [-- other pc_server args]
+#
+# Starts pc_server.py on localhost with --protocol frame --timestamps --gpu fake, connects
+# main.py's own get_data and display_updater threads to it (through emu), or with --async its
+# asyncio client (async_main, in one thread), and follows each sample through the stages:
+#   sample -> send     collector tick until the frame was encoded for sending (server)
+#   send -> recv       network plus the pico's select/sleep polling
+#   recv -> parsed     parsing and handing over to the display thread
+#   parsed -> shown    waiting for and drawing the frame, up to show() returning
+# Also reports frames drawn per second, bytes on the wire and cpu per stage.
+# Everything is on one machine so the clocks agree.
+#
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import emu
+
+emu.install()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import machine  # noqa: E402  (emu/mp)
+import main  # noqa: E402
+import ssd1306  # noqa: E402
+
+
+def percentile(values, pc):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pc / 100))]
+
+
+def field(line, name):
+    '''Pull an integer name:value out of a frame, None if it isn't there'''
+    start = line.find(name + b':')
+    if start < 0:
+        return None
+    start += len(name) + 1
+    end = start
+    while end < len(line) and 48 <= line[end] <= 57:
+        end += 1
+    return int(line[start:end]) / 1000000 if end > start else None
+
+
+class Tracer:
+    '''Hooks into main.py to timestamp every stage of each sample'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.recv_time = 0.0
+        self.parsed = []      # (ts, tx, recv) parsed but not yet published
+        self.published = None  # (ts, tx, recv, published)
+        self.samples = 0
+        self.shown = []       # (ts, tx, recv, published, shown)
+
+    def install(self, display):
+        tracer = self
+        real_readinto = socket.socket.readinto
+        real_stream_readinto = main.stream_readinto
+        real_parse_line = main.parse_line
+        real_publish = main.publish
+        real_show = display.show
+
+        def readinto(sock, buf):
+            n = real_readinto(sock, buf)
+            tracer.recv_time = time.time()
+            tracer.bytes += n or 0
+            return n
+
+        async def stream_readinto(stream, buf):
+            n = await real_stream_readinto(stream, buf)
+            tracer.recv_time = time.time()
+            tracer.bytes += n or 0
+            return n
+
+        def parse_line(buf, start, end):
+            real_parse_line(buf, start, end)
+            line = bytes(buf[start:end])
+            ts = field(line, b'ts')
+            if ts is not None:
+                tracer.parsed.append((ts, field(line, b'tx'), tracer.recv_time))
+
+        def publish():
+            real_publish()
+            now = time.time()
+            with tracer.lock:
+                for ts, tx, recv in tracer.parsed:
+                    tracer.samples += 1
+                    tracer.published = (ts, tx, recv, now)
+                tracer.parsed = []
+
+        def show(full=False):
+            real_show(full)
+            now = time.time()
+            with tracer.lock:
+                if tracer.published is not None:
+                    tracer.shown.append(tracer.published + (now,))
+                    tracer.published = None
+
+        socket.socket.readinto = readinto
+        main.stream_readinto = stream_readinto
+        main.parse_line = parse_line
+        main.publish = publish
+        display.show = show
+
+
+def thread_cpu(thread):
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Sample to pixel latency of pc_server + main.py')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--port', type=int, default=9112)
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--delta', action='store_true')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="main.py's asyncio client instead of its threads")
+    parser.add_argument('server_args', nargs='*', help='passed on to pc_server.py (put them after --)')
+    args = parser.parse_args()
+
+    command = [sys.executable, os.path.join(ROOT, 'pc_server.py'), '--host', '127.0.0.1', '--port', str(args.port),
+               '--mode', args.mode, '--protocol', 'frame', '--timestamps', '--gpu', 'fake'] + args.server_args
+    if args.delta:
+        command.append('--delta')
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)
+
+    i2c = machine.I2C(0, freq=main.C_FREQ)
+    display = ssd1306.SSD1306_I2C(128, 64, i2c)
+    tracer = Tracer()
+    tracer.install(display)
+
+    main.PC_IP = '127.0.0.1'
+    main.PC_PORT = args.port
+    main.C_PROTOCOL = 'frame'
+    if args.use_async:
+        # network, parsing and drawing all in one thread, render is the same thread
+        net = render = threading.Thread(target=lambda: main.asyncio.run(main.async_main(display)), daemon=True)
+        net.start()
+        time.sleep(0.5)
+    else:
+        main.sock = main.connect_to_pc()
+        if main.sock is None:
+            server.kill()
+            sys.exit('could not connect to pc_server')
+        net = threading.Thread(target=main.get_data, daemon=True)
+        render = threading.Thread(target=main.display_updater, args=(display,), daemon=True)
+        net.start()
+        render.start()
+        time.sleep(0.2)
+
+    # only measure the steady state
+    with tracer.lock:
+        tracer.shown = []
+        tracer.samples = 0
+    tracer.bytes = 0
+    i2c.reset_counters()
+    net_cpu = thread_cpu(net)
+    render_cpu = thread_cpu(render)
+    start = time.time()
+    time.sleep(args.seconds)
+    elapsed = time.time() - start
+    net_cpu = thread_cpu(net) - net_cpu
+    render_cpu = thread_cpu(render) - render_cpu
+    if args.use_async:
+        render_cpu = 0
+    with tracer.lock:
+        shown = list(tracer.shown)
+        samples = tracer.samples
+    received = tracer.bytes
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server.terminate()
+    server.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # includes the second of startup, good enough to compare runs of the same length
+    server_cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+    stages = (
+        ('sample -> send', [tx - ts for ts, tx, recv, pub, seen in shown if tx is not None]),
+        ('send -> recv', [recv - tx for ts, tx, recv, pub, seen in shown if tx is not None]),
+        ('recv -> parsed', [pub - recv for ts, tx, recv, pub, seen in shown]),
+        ('parsed -> shown', [seen - pub for ts, tx, recv, pub, seen in shown]),
+        ('sample -> shown', [seen - ts for ts, tx, recv, pub, seen in shown]),
+    )
+    print('{:<16} {:>9} {:>9}'.format('stage', 'p50 ms', 'p99 ms'))
+    for name, values in stages:
+        print('{:<16} {:>9.2f} {:>9.2f}'.format(name, percentile(values, 50) * 1000, percentile(values, 99) * 1000))
+    print()
+    print('samples received {}, frames drawn {} ({:.2f} fps)'.format(samples, len(shown), len(shown) / elapsed))
+    print('bytes on the wire {} ({:.0f} B/s), i2c bytes {} ({:.0f} B/s)'.format(
+        received, received / elapsed, i2c.bytes_written, i2c.bytes_written / elapsed))
+    if args.use_async:
+        print('cpu: server {:.1f}% (run incl. startup {:.2f}s), pico asyncio thread {:.1f}%'.format(
+            server_cpu * 100 / (elapsed + 1.2), server_cpu, net_cpu * 100 / elapsed))
+    else:
+        print('cpu: server {:.1f}% (run incl. startup {:.2f}s), pico net thread {:.1f}%, pico render thread {:.1f}%'.format(
+            server_cpu * 100 / (elapsed + 1.2), server_cpu, net_cpu * 100 / elapsed, render_cpu * 100 / elapsed))
+
+
+if __name__ == '__main__':
+    main_bench()
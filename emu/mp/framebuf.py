@@ -0,0 +1,281 @@
+# framebuf.py - stand-in for MicroPython's framebuf module, for running the pico code on linux.
+# Only MONO_VLSB (what the SSD1306 uses) is supported. Drawing matches MicroPython's
+# extmod/modframebuf.c pixel for pixel, including clipping, text and scroll.
+#
+
+MONO_VLSB = 0
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB = 5
+GS8 = 6
+MVLSB = MONO_VLSB
+
+# font_petme128_8x8 from MicroPython (MIT licence), chars 32 to 127, one byte per column, bit 0 at the top
+FONT = (
+    b'\x00\x00\x00\x00\x00\x00\x00\x00'  # ' '
+    b'\x00\x00\x00\x4f\x4f\x00\x00\x00'  # '!'
+    b'\x00\x07\x07\x00\x00\x07\x07\x00'  # '"'
+    b'\x14\x7f\x7f\x14\x14\x7f\x7f\x14'  # '#'
+    b'\x00\x24\x2e\x6b\x6b\x3a\x12\x00'  # '$'
+    b'\x00\x63\x33\x18\x0c\x66\x63\x00'  # '%'
+    b'\x00\x32\x7f\x4d\x4d\x77\x72\x50'  # '&'
+    b'\x00\x00\x00\x04\x06\x03\x01\x00'  # "'"
+    b'\x00\x00\x1c\x3e\x63\x41\x00\x00'  # '('
+    b'\x00\x00\x41\x63\x3e\x1c\x00\x00'  # ')'
+    b'\x08\x2a\x3e\x1c\x1c\x3e\x2a\x08'  # '*'
+    b'\x00\x08\x08\x3e\x3e\x08\x08\x00'  # '+'
+    b'\x00\x00\x80\xe0\x60\x00\x00\x00'  # ','
+    b'\x00\x08\x08\x08\x08\x08\x08\x00'  # '-'
+    b'\x00\x00\x00\x60\x60\x00\x00\x00'  # '.'
+    b'\x00\x40\x60\x30\x18\x0c\x06\x02'  # '/'
+    b'\x00\x3e\x7f\x49\x45\x7f\x3e\x00'  # '0'
+    b'\x00\x40\x44\x7f\x7f\x40\x40\x00'  # '1'
+    b'\x00\x62\x73\x51\x49\x4f\x46\x00'  # '2'
+    b'\x00\x22\x63\x49\x49\x7f\x36\x00'  # '3'
+    b'\x00\x18\x18\x14\x16\x7f\x7f\x10'  # '4'
+    b'\x00\x27\x67\x45\x45\x7d\x39\x00'  # '5'
+    b'\x00\x3e\x7f\x49\x49\x7b\x32\x00'  # '6'
+    b'\x00\x03\x03\x79\x7d\x07\x03\x00'  # '7'
+    b'\x00\x36\x7f\x49\x49\x7f\x36\x00'  # '8'
+    b'\x00\x26\x6f\x49\x49\x7f\x3e\x00'  # '9'
+    b'\x00\x00\x00\x24\x24\x00\x00\x00'  # ':'
+    b'\x00\x00\x80\xe4\x64\x00\x00\x00'  # ';'
+    b'\x00\x08\x1c\x36\x63\x41\x41\x00'  # '<'
+    b'\x00\x14\x14\x14\x14\x14\x14\x00'  # '='
+    b'\x00\x41\x41\x63\x36\x1c\x08\x00'  # '>'
+    b'\x00\x02\x03\x51\x59\x0f\x06\x00'  # '?'
+    b'\x00\x3e\x7f\x41\x4d\x4f\x2e\x00'  # '@'
+    b'\x00\x7c\x7e\x0b\x0b\x7e\x7c\x00'  # 'A'
+    b'\x00\x7f\x7f\x49\x49\x7f\x36\x00'  # 'B'
+    b'\x00\x3e\x7f\x41\x41\x63\x22\x00'  # 'C'
+    b'\x00\x7f\x7f\x41\x63\x3e\x1c\x00'  # 'D'
+    b'\x00\x7f\x7f\x49\x49\x41\x41\x00'  # 'E'
+    b'\x00\x7f\x7f\x09\x09\x01\x01\x00'  # 'F'
+    b'\x00\x3e\x7f\x41\x49\x7b\x3a\x00'  # 'G'
+    b'\x00\x7f\x7f\x08\x08\x7f\x7f\x00'  # 'H'
+    b'\x00\x00\x41\x7f\x7f\x41\x00\x00'  # 'I'
+    b'\x00\x20\x60\x41\x7f\x3f\x01\x00'  # 'J'
+    b'\x00\x7f\x7f\x1c\x36\x63\x41\x00'  # 'K'
+    b'\x00\x7f\x7f\x40\x40\x40\x40\x00'  # 'L'
+    b'\x00\x7f\x7f\x06\x0c\x06\x7f\x7f'  # 'M'
+    b'\x00\x7f\x7f\x0e\x1c\x7f\x7f\x00'  # 'N'
+    b'\x00\x3e\x7f\x41\x41\x7f\x3e\x00'  # 'O'
+    b'\x00\x7f\x7f\x09\x09\x0f\x06\x00'  # 'P'
+    b'\x00\x1e\x3f\x21\x61\x7f\x5e\x00'  # 'Q'
+    b'\x00\x7f\x7f\x19\x39\x6f\x46\x00'  # 'R'
+    b'\x00\x26\x6f\x49\x49\x7b\x32\x00'  # 'S'
+    b'\x00\x01\x01\x7f\x7f\x01\x01\x00'  # 'T'
+    b'\x00\x3f\x7f\x40\x40\x7f\x3f\x00'  # 'U'
+    b'\x00\x1f\x3f\x60\x60\x3f\x1f\x00'  # 'V'
+    b'\x00\x7f\x7f\x30\x18\x30\x7f\x7f'  # 'W'
+    b'\x00\x63\x77\x1c\x1c\x77\x63\x00'  # 'X'
+    b'\x00\x07\x0f\x78\x78\x0f\x07\x00'  # 'Y'
+    b'\x00\x61\x71\x59\x4d\x47\x43\x00'  # 'Z'
+    b'\x00\x00\x7f\x7f\x41\x41\x00\x00'  # '['
+    b'\x00\x02\x06\x0c\x18\x30\x60\x40'  # '\\'
+    b'\x00\x00\x41\x41\x7f\x7f\x00\x00'  # ']'
+    b'\x00\x08\x0c\x06\x06\x0c\x08\x00'  # '^'
+    b'\xc0\xc0\xc0\xc0\xc0\xc0\xc0\xc0'  # '_'
+    b'\x00\x00\x01\x03\x06\x04\x00\x00'  # '`'
+    b'\x00\x20\x74\x54\x54\x7c\x78\x00'  # 'a'
+    b'\x00\x7f\x7f\x44\x44\x7c\x38\x00'  # 'b'
+    b'\x00\x38\x7c\x44\x44\x6c\x28\x00'  # 'c'
+    b'\x00\x38\x7c\x44\x44\x7f\x7f\x00'  # 'd'
+    b'\x00\x38\x7c\x54\x54\x5c\x58\x00'  # 'e'
+    b'\x00\x08\x7e\x7f\x09\x03\x02\x00'  # 'f'
+    b'\x00\x98\xbc\xa4\xa4\xfc\x7c\x00'  # 'g'
+    b'\x00\x7f\x7f\x04\x04\x7c\x78\x00'  # 'h'
+    b'\x00\x00\x00\x7d\x7d\x00\x00\x00'  # 'i'
+    b'\x00\x40\xc0\x80\x80\xfd\x7d\x00'  # 'j'
+    b'\x00\x7f\x7f\x30\x38\x6c\x44\x00'  # 'k'
+    b'\x00\x00\x41\x7f\x7f\x40\x00\x00'  # 'l'
+    b'\x00\x7c\x7c\x18\x30\x18\x7c\x7c'  # 'm'
+    b'\x00\x7c\x7c\x04\x04\x7c\x78\x00'  # 'n'
+    b'\x00\x38\x7c\x44\x44\x7c\x38\x00'  # 'o'
+    b'\x00\xfc\xfc\x24\x24\x3c\x18\x00'  # 'p'
+    b'\x00\x18\x3c\x24\x24\xfc\xfc\x00'  # 'q'
+    b'\x00\x7c\x7c\x04\x04\x0c\x08\x00'  # 'r'
+    b'\x00\x48\x5c\x54\x54\x74\x20\x00'  # 's'
+    b'\x04\x04\x3f\x7f\x44\x64\x20\x00'  # 't'
+    b'\x00\x3c\x7c\x40\x40\x7c\x3c\x00'  # 'u'
+    b'\x00\x1c\x3c\x60\x60\x3c\x1c\x00'  # 'v'
+    b'\x00\x1c\x7c\x30\x18\x30\x7c\x1c'  # 'w'
+    b'\x00\x44\x6c\x38\x38\x6c\x44\x00'  # 'x'
+    b'\x00\x9c\xbc\xa0\xa0\xfc\x7c\x00'  # 'y'
+    b'\x00\x44\x64\x74\x5c\x4c\x44\x00'  # 'z'
+    b'\x00\x08\x08\x3e\x77\x41\x41\x00'  # '{'
+    b'\x00\x00\x00\xff\xff\x00\x00\x00'  # '|'
+    b'\x00\x41\x41\x77\x3e\x08\x08\x00'  # '}'
+    b'\x00\x02\x03\x01\x03\x02\x03\x01'  # '~'
+    b'\xaa\x55\xaa\x55\xaa\x55\xaa\x55'  # 'DEL'
+)
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format != MONO_VLSB:
+            raise ValueError('emu framebuf only does MONO_VLSB')
+        self.buf = buffer
+        self.width = width
+        self.height = height
+        self.format = format
+        self.stride = width if stride is None else stride
+        if len(buffer) < ((height + 7) // 8) * self.stride:
+            raise ValueError('buffer too small')
+
+    # raw pixel access, no clipping
+    def _get(self, x, y):
+        return (self.buf[(y >> 3) * self.stride + x] >> (y & 7)) & 1
+
+    def _set(self, x, y, c):
+        i = (y >> 3) * self.stride + x
+        if c:
+            self.buf[i] |= 1 << (y & 7)
+        else:
+            self.buf[i] &= ~(1 << (y & 7)) & 0xFF
+
+    def fill(self, c):
+        v = 0xFF if c else 0x00
+        for i in range(((self.height + 7) // 8) * self.stride):
+            self.buf[i] = v
+
+    def pixel(self, x, y, c=None):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            if c is None:
+                return self._get(x, y)
+            self._set(x, y, c)
+        elif c is None:
+            return None
+
+    def fill_rect(self, x, y, w, h, c):
+        if h < 1 or w < 1 or x + w <= 0 or y + h <= 0 or y >= self.height or x >= self.width:
+            return
+        xend = min(self.width, x + w)
+        yend = min(self.height, y + h)
+        x = max(x, 0)
+        y = max(y, 0)
+        # a page (8 rows) at a time
+        while y < yend:
+            page_end = min((y | 7) + 1, yend)
+            mask = (0xFF << (y & 7)) & (0xFF >> (8 - (page_end - (y & ~7))))
+            row = (y >> 3) * self.stride
+            for i in range(row + x, row + xend):
+                if c:
+                    self.buf[i] |= mask
+                else:
+                    self.buf[i] &= ~mask & 0xFF
+            y = page_end
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+        else:
+            self.fill_rect(x, y, w, 1, c)
+            self.fill_rect(x, y + h - 1, w, 1, c)
+            self.fill_rect(x, y, 1, h, c)
+            self.fill_rect(x + w - 1, y, 1, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        # same bresenham as modframebuf.c, so the same pixels get set
+        dx = x2 - x1
+        if dx > 0:
+            sx = 1
+        else:
+            dx = -dx
+            sx = -1
+        dy = y2 - y1
+        if dy > 0:
+            sy = 1
+        else:
+            dy = -dy
+            sy = -1
+        steep = dy > dx
+        if steep:
+            x1, y1 = y1, x1
+            dx, dy = dy, dx
+            sx, sy = sy, sx
+        e = 2 * dy - dx
+        for i in range(dx):
+            if steep:
+                self.pixel(y1, x1, c)
+            else:
+                self.pixel(x1, y1, c)
+            while e >= 0:
+                y1 += sy
+                e -= 2 * dx
+            x1 += sx
+            e += 2 * dy
+        self.pixel(x2, y2, c)
+
+    def text(self, s, x0, y0, c=1):
+        for ch in s:
+            code = ord(ch)
+            if code < 32 or code > 127:
+                code = 127
+            glyph = (code - 32) * 8
+            for j in range(8):
+                column = FONT[glyph + j]
+                x = x0 + j
+                if 0 <= x < self.width:
+                    y = y0
+                    while column:
+                        if column & 1 and 0 <= y < self.height:
+                            self._set(x, y, c)
+                        column >>= 1
+                        y += 1
+            x0 += 8
+
+    def scroll(self, xstep, ystep):
+        # exposed pixels keep whatever was there, like the real thing
+        if xstep < 0:
+            sx, xend, dx = 0, self.width + xstep, 1
+            if xend <= 0:
+                return
+        else:
+            sx, xend, dx = self.width - 1, xstep - 1, -1
+            if xend >= sx:
+                return
+        if ystep < 0:
+            y, yend, dy = 0, self.height + ystep, 1
+            if yend <= 0:
+                return
+        else:
+            y, yend, dy = self.height - 1, ystep - 1, -1
+            if yend >= y:
+                return
+        while y != yend:
+            x = sx
+            while x != xend:
+                self._set(x, y, self._get(x - xstep, y - ystep))
+                x += dx
+            y += dy
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        if isinstance(fbuf, tuple):
+            fbuf = FrameBuffer(*fbuf)
+        if (x >= self.width or y >= self.height or -x >= fbuf.width or -y >= fbuf.height):
+            return
+        x0 = max(0, x)
+        y0 = max(0, y)
+        x1 = max(0, -x)
+        y1 = max(0, -y)
+        x0end = min(self.width, x + fbuf.width)
+        y0end = min(self.height, y + fbuf.height)
+        for cy in range(y0, y0end):
+            cx1 = x1
+            for cx in range(x0, x0end):
+                col = fbuf._get(cx1, y1)
+                if palette is not None:
+                    col = palette.pixel(col, 0)
+                if col != key:
+                    self._set(cx, cy, col)
+                cx1 += 1
+            y1 += 1
@@ -0,0 +1,132 @@
+# machine.py - stand-in for MicroPython's machine module, for running the pico code on linux.
+# I2C and SPI don't talk to anything, they count transactions and bytes so the cost of a
+# frame can be measured. A device (eg emu.panel.SSD1306Panel) can be attached to an I2C
+# address to see what actually got written.
+#
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 0 if value is None else value
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.mode = mode
+        if value is not None:
+            self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class Bus:
+    '''Counting shared by I2C and SPI'''
+    def __init__(self):
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes_written = 0
+
+    def count(self, nbytes):
+        self.transactions += 1
+        self.bytes_written += nbytes
+
+
+class I2C(Bus):
+    def __init__(self, id=0, scl=None, sda=None, freq=400000, timeout=50000):
+        self.id = id
+        self.freq = freq
+        self.devices = {}
+        super().__init__()
+
+    def attach(self, addr, device):
+        '''Send everything written to addr to device.write(bytes)'''
+        self.devices[addr] = device
+
+    def bus_time(self):
+        '''Seconds the writes so far would take on the wire: 9 clocks a byte plus the address byte, start and stop'''
+        return (self.bytes_written + self.transactions) * 9 / self.freq + self.transactions * 2 / self.freq
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        self.count(len(buf))
+        if addr in self.devices:
+            self.devices[addr].write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        data = b''.join(bytes(b) for b in vector)
+        self.count(len(data))
+        if addr in self.devices:
+            self.devices[addr].write(data)
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return bytes(nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+
+class SoftI2C(I2C):
+    pass
+
+
+class SPI(Bus):
+    def __init__(self, id=0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=0, sck=None, mosi=None, miso=None):
+        self.id = id
+        self.baudrate = baudrate
+        super().__init__()
+
+    def init(self, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=0, sck=None, mosi=None, miso=None):
+        self.baudrate = baudrate
+
+    def bus_time(self):
+        return self.bytes_written * 8 / self.baudrate
+
+    def write(self, buf):
+        self.count(len(buf))
+
+    def read(self, nbytes, write=0x00):
+        return bytes(nbytes)
+
+    def write_readinto(self, write_buf, read_buf):
+        self.count(len(write_buf))
+
+
+class SoftSPI(SPI):
+    pass
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def unique_id():
+    return b'\x00emu\x00pico'
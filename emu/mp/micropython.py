@@ -0,0 +1,26 @@
+# micropython.py - stand-in for the micropython module, the code emitter decorators do nothing here.
+#
+
+
+def const(value):
+    return value
+
+
+def native(f):
+    return f
+
+
+def viper(f):
+    return f
+
+
+def mem_info(verbose=None):
+    pass
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(func, arg):
+    func(arg)
@@ -0,0 +1,3 @@
+# placeholder so main.py imports on linux, the emulated wifi ignores these
+WIFI_SSID = 'emu'
+WIFI_PASSWORD = 'emu'
@@ -0,0 +1,83 @@
+# panel.py - a model of the SSD1306 controller's side of the I2C bus.
+# Attach it to an emulated I2C (i2c.attach(0x3C, SSD1306Panel())) and it keeps its own copy
+# of the display RAM from the commands and data the driver sends, so what ends up on the
+# "glass" can be compared with the driver's framebuffer.
+#
+import framebuf
+
+# commands followed by argument bytes, and how many
+ARGS = {
+    0x20: 1,  # memory addressing mode
+    0x21: 2,  # column address
+    0x22: 2,  # page address
+    0x81: 1,  # contrast
+    0x8D: 1,  # charge pump
+    0xA8: 1,  # mux ratio
+    0xD3: 1,  # display offset
+    0xD5: 1,  # clock divide
+    0xD9: 1,  # precharge
+    0xDA: 1,  # com pins
+    0xDB: 1,  # vcom deselect
+}
+
+
+class SSD1306Panel:
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.ram = bytearray(self.pages * width)
+        self.col_start, self.col_end = 0, width - 1
+        self.page_start, self.page_end = 0, self.pages - 1
+        self.col, self.page = 0, 0
+        self.on = False
+        self.pending = None
+        self.args = []
+        self.commands = 0
+        self.data_bytes = 0
+
+    def write(self, data):
+        control = data[0]
+        if control & 0x40:
+            for b in data[1:]:
+                self.data(b)
+        else:
+            for b in data[1:]:
+                self.command(b)
+
+    def command(self, b):
+        self.commands += 1
+        if self.pending is not None:
+            self.args.append(b)
+            if len(self.args) == ARGS[self.pending]:
+                self.apply(self.pending, self.args)
+                self.pending = None
+            return
+        if b in ARGS:
+            self.pending = b
+            self.args = []
+        elif b & 0xFE == 0xAE:
+            self.on = bool(b & 1)
+
+    def apply(self, cmd, args):
+        if cmd == 0x21:
+            self.col_start, self.col_end = args
+            self.col = self.col_start
+        elif cmd == 0x22:
+            self.page_start, self.page_end = args
+            self.page = self.page_start
+
+    def data(self, b):
+        # horizontal addressing mode, wraps inside the column/page window
+        self.data_bytes += 1
+        if self.col < self.width and self.page < self.pages:
+            self.ram[self.page * self.width + self.col] = b
+        if self.col >= self.col_end:
+            self.col = self.col_start
+            self.page = self.page_start if self.page >= self.page_end else self.page + 1
+        else:
+            self.col += 1
+
+    def framebuffer(self):
+        '''The panel's RAM as a FrameBuffer, for dumping'''
+        return framebuf.FrameBuffer(self.ram, self.width, self.height, framebuf.MONO_VLSB)
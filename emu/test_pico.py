@@ -0,0 +1,371 @@
+# test_pico.py - regression tests for the pico side, run on linux through emu.
+#
+#   python -m pytest emu
+#
+# What pc_server sends goes through main.drain_recv cut into random pieces, the way recv hands
+# it over, and has to end up in the metrics. The incremental drawing (draw_bar_graph with
+# last_width, SSD1306.show() sending only what changed) has to end up the same as drawing
+# everything from scratch. The server's side of it is here too: parse_hello, the relay
+# (parse_frame, merge_snapshots) and --delta (DeltaFilter).
+#
+import os
+import random
+import sys
+
+import emu
+
+emu.install()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import framebuf  # noqa: E402  (emu/mp)
+import machine  # noqa: E402
+import main  # noqa: E402
+import pc_server  # noqa: E402
+import ssd1306  # noqa: E402
+from emu.panel import SSD1306Panel  # noqa: E402
+
+
+def random_snapshot(rng, relay=False):
+    '''A snapshot like Collector's with 0 to 3 gpus, or RelayCollector's with a host'''
+    gpus = [[rng.randint(0, 100), rng.randint(0, 24000), 24576] for i in range(rng.choice((0, 1, 2, 3)))]
+    snapshot = {
+        'cpu': rng.randint(0, 100), 'ram': round(rng.uniform(1, 31), 1), 'ram_total': 31.3,
+        'disk': rng.randint(0, 50000000), 'gpu': rng.randint(0, 100),
+        'vram': rng.randint(0, 12282), 'vram_total': 12282, 'gpus': gpus,
+        'time': 0.0,
+    }
+    if relay:
+        snapshot['host'] = rng.randint(0, 3)
+    if rng.random() < 0.5:
+        snapshot.update(cpu_max=rng.randint(0, 100), gpu_max=rng.randint(0, 100), disk_max=rng.randint(0, 50000000))
+    return snapshot
+
+
+def expected_metrics(snapshot):
+    '''slot -> value main.metrics should hold once a v3 tick of snapshot is in'''
+    expected = {
+        main.M_CPU: snapshot['cpu'], main.M_RAM: snapshot['ram'], main.M_RAM_TOTAL: snapshot['ram_total'],
+        main.M_DISK: snapshot['disk'], main.M_GPU: snapshot['gpu'], main.M_VRAM: snapshot['vram'],
+        main.M_VRAM_TOTAL: snapshot['vram_total'], main.M_HOST: snapshot.get('host', 0),
+        main.M_GPU_COUNT: len(snapshot['gpus']), main.M_CPU_PEAK: snapshot.get('cpu_max', 0),
+        main.M_GPU_PEAK: snapshot.get('gpu_max', 0), main.M_DISK_PEAK: snapshot.get('disk_max', 0),
+    }
+    if len(snapshot['gpus']) >= 2:
+        for i, gpu in enumerate(snapshot['gpus']):
+            for part in range(3):
+                expected[main.M_GPUS + i * 3 + part] = gpu[part]
+    return expected
+
+
+def feed(rng, data, left=0):
+    '''Push data through main.drain_recv in random sized pieces, returns what's left over'''
+    pos = 0
+    while pos < len(data):
+        n = rng.randint(1, min(len(data) - pos, main.C_RECV_SIZE - left))
+        main.recv_buf[left:left + n] = data[pos:pos + n]
+        left = main.drain_recv(left + n)
+        pos += n
+    return left
+
+
+def check_metrics(expected):
+    for slot, value in expected.items():
+        # metrics is an array of float32, disk goes up to 50M
+        assert abs(main.metrics[slot] - value) <= max(0.01, value * 1e-6), (slot, main.metrics[slot], value)
+
+
+def test_bin_round_trip():
+    rng = random.Random(1)
+    main.clear_metrics(0, main.M_COUNT)
+    for seq in range(200):
+        snapshot = random_snapshot(rng, rng.random() < 0.5)
+        data = pc_server.pack_record(snapshot, seq) + pc_server.pack_gpu_records(snapshot) + pc_server.pack_peak_record(snapshot)
+        assert feed(rng, data) == 0
+        check_metrics(expected_metrics(snapshot))
+
+
+def test_frame_round_trip():
+    rng = random.Random(2)
+    main.clear_metrics(0, main.M_COUNT)
+    names = pc_server.MESSAGE_ORDER + ('gpus', 'peak')
+    for seq in range(200):
+        # a frame only has host from a relay, a server doesn't turn into one half way
+        snapshot = random_snapshot(rng, seq >= 100)
+        data = '{}\r\n'.format(pc_server.format_frame(snapshot, names)).encode()
+        assert feed(rng, data) == 0
+        check_metrics(expected_metrics(snapshot))
+
+
+def test_mixed_stream_round_trip():
+    '''tick_payload for a v3 client, bin and frame ticks back to back, cut anywhere'''
+    rng = random.Random(3)
+    main.clear_metrics(0, main.M_COUNT)
+    left = 0
+    for seq in range(200):
+        snapshot = random_snapshot(rng, True)
+        encoder = pc_server.TickEncoder(seq, snapshot)
+        data = pc_server.tick_payload(encoder, rng.choice(('bin', 'frame')), 0, None, pc_server.PROTOCOL_VERSION)
+        # end this tick part way into the next one now and then
+        left = feed(rng, data, left)
+    assert left == 0
+    check_metrics(expected_metrics(snapshot))
+
+
+def test_host_change_clears_peaks():
+    rng = random.Random(4)
+    main.clear_metrics(0, main.M_COUNT)
+    snapshot = random_snapshot(rng, True)
+    snapshot.update(host=1, cpu_max=90, gpu_max=80, disk_max=1000, gpus=[[1, 2, 3], [4, 5, 6]])
+    feed(rng, '{}\n'.format(pc_server.format_frame(snapshot, pc_server.MESSAGE_ORDER + ('gpus', 'peak'))).encode())
+    # an old peer with no peaks or cards behind a relay
+    del snapshot['cpu_max'], snapshot['gpu_max'], snapshot['disk_max']
+    snapshot.update(host=2, gpus=[])
+    feed(rng, '{}\n'.format(pc_server.format_frame(snapshot)).encode())
+    assert main.metrics[main.M_HOST] == 2
+    assert main.metrics[main.M_CPU_PEAK] == 0 and main.metrics[main.M_GPU_COUNT] == 0
+
+
+def new_fbuf():
+    buf = bytearray(128 * 64 // 8)
+    return buf, framebuf.FrameBuffer(buf, 128, 64, framebuf.MONO_VLSB)
+
+
+def test_incremental_bar_graph():
+    rng = random.Random(5)
+    for show_scale in (False, True):
+        inc_buf, incremental = new_fbuf()
+        last_width = main.draw_bar_graph(incremental, 50, main.C_BAR_STARTX, 0, main.C_BAR_WIDTH, main.C_BAR_HEIGHT, show_scale)
+        for i in range(300):
+            value = rng.choice((-5, 0, 99, 120, rng.uniform(0, 99)))
+            last_width = main.draw_bar_graph(incremental, value, main.C_BAR_STARTX, 0, main.C_BAR_WIDTH,
+                                             main.C_BAR_HEIGHT, show_scale, last_width)
+            full_buf, full = new_fbuf()
+            width = main.draw_bar_graph(full, value, main.C_BAR_STARTX, 0, main.C_BAR_WIDTH, main.C_BAR_HEIGHT, show_scale)
+            assert width == last_width
+            assert inc_buf == full_buf, (i, value)
+
+
+def make_display():
+    i2c = machine.I2C(0, freq=main.C_FREQ)
+    panel = SSD1306Panel()
+    i2c.attach(0x3C, panel)
+    return i2c, panel, ssd1306.SSD1306_I2C(128, 64, i2c)
+
+
+def test_partial_show_matches_panel():
+    rng = random.Random(6)
+    i2c, panel, display = make_display()
+    display.show()
+    assert bytes(panel.ram) == bytes(display.buffer)
+    for i in range(300):
+        # a few small changes anywhere, sometimes none, sometimes a lot
+        for n in range(rng.choice((0, 1, 3, 20))):
+            x, y = rng.randrange(128), rng.randrange(64)
+            if rng.random() < 0.5:
+                display.pixel(x, y, rng.randint(0, 1))
+            else:
+                display.fill_rect(x, y, rng.randint(1, 40), rng.randint(1, 20), rng.randint(0, 1))
+        if rng.random() < 0.1:
+            display.text(str(rng.randint(0, 99999)), rng.randrange(100), rng.randrange(56))
+        i2c.reset_counters()
+        display.show()
+        assert bytes(panel.ram) == bytes(display.buffer), i
+    # nothing changed, nothing sent
+    i2c.reset_counters()
+    display.show()
+    assert i2c.bytes_written == 0
+
+
+def test_partial_show_sends_less():
+    i2c, panel, display = make_display()
+    display.show()
+    display.pixel(5, 5, 1)
+    display.pixel(100, 60, 1)
+    i2c.reset_counters()
+    display.show()
+    assert bytes(panel.ram) == bytes(display.buffer)
+    assert i2c.bytes_written < 1024
+
+
+def test_parse_hello():
+    assert pc_server.parse_hello(b'hello:3:bin,frame,lines\n') == ('bin', 3)
+    assert pc_server.parse_hello(b'hello:2:zip,frame\r\n') == ('frame', 2)
+    assert pc_server.parse_hello(b'hello:1:zip') is None
+    assert pc_server.parse_hello(b'hello:x:bin') is None
+    assert pc_server.parse_hello(b'hello:3') is None
+    assert pc_server.parse_hello(b'cpu:12') is None
+    assert pc_server.parse_hello(b'\xffhello:3:bin') is None
+
+
+def peer_frame(snapshot, names=pc_server.MESSAGE_ORDER + ('gpus', 'peak')):
+    '''What a relay's Peer gets from a v3 pc_server asked for frames'''
+    return pc_server.format_frame(snapshot, names)
+
+
+def test_parse_frame_round_trip():
+    rng = random.Random(7)
+    values = {}
+    for i in range(100):
+        snapshot = random_snapshot(rng)
+        pc_server.parse_frame(peer_frame(snapshot), values)
+        for key in ('cpu', 'ram', 'ram_total', 'disk', 'gpu', 'vram', 'vram_total'):
+            assert values[key] == snapshot[key], key
+        assert values['cpu_max'] == snapshot.get('cpu_max', 0)
+        if len(snapshot['gpus']) == 1:
+            # the one card is the totals
+            assert values['gpus'] == [[snapshot['gpu'], snapshot['vram'], snapshot['vram_total']]]
+        else:
+            assert values['gpus'] == snapshot['gpus']
+        # a relay of relays ends up with the same
+        chained = {}
+        pc_server.parse_frame(peer_frame(values), chained)
+        assert chained == values
+
+
+def test_parse_frame_one_card():
+    '''A relay keeps a one card peer's count, not 0'''
+    values = {}
+    pc_server.parse_frame('cpu:5|ram:1.0/2.0|disk:0|gpu:40|vram:100/8000|gn:1', values)
+    assert values['gpus'] == [[40, 100, 8000]]
+    assert 'gn:1' in peer_frame(values)
+    # a --delta peer sends the totals when they move, gn only when the count does
+    pc_server.parse_frame('gpu:70', values)
+    assert values['gpus'] == [[70, 100, 8000]]
+    pc_server.parse_frame('gn:0', values)
+    assert values['gpus'] == [] and 'gn:0' in peer_frame(values)
+
+
+def test_parse_frame_gpu_count_changes():
+    values = {}
+    pc_server.parse_frame('gpu:20|vram:300/2000|gn:3|g0:10/100/1000|g1:20/200/500|g2:30/0/500', values)
+    assert values['gpus'] == [[10, 100, 1000], [20, 200, 500], [30, 0, 500]]
+    pc_server.parse_frame('gn:2|g0:11/100/1000|g1:21/200/500', values)
+    assert values['gpus'] == [[11, 100, 1000], [21, 200, 500]]
+    pc_server.parse_frame('gpu:15|vram:100/1000|gn:1', values)
+    assert values['gpus'] == [[15, 100, 1000]]
+    # a card the count doesn't cover is ignored
+    pc_server.parse_frame('g3:1/2/3', values)
+    assert values['gpus'] == [[15, 100, 1000]]
+
+
+def test_parse_frame_skips_junk():
+    values = {'cpu': 1}
+    pc_server.parse_frame('cpu:x|new:1/2|ram:3.5|gn:many||:|host:4', values)
+    # a part that doesn't parse leaves what was there, the peer's host is the peer's business
+    assert values == {'cpu': 1, 'ram': 3.5}
+
+
+def test_merge_snapshots():
+    one = {'cpu': 10, 'ram': 1.25, 'ram_total': 8.0, 'disk': 100, 'gpu': 40, 'vram': 100, 'vram_total': 8000,
+           'gpus': [[40, 100, 8000]]}
+    two = {'cpu': 31, 'ram': 2.0, 'ram_total': 16.0, 'disk': 50, 'gpu': 20, 'vram': 300, 'vram_total': 2000,
+           'gpus': [[10, 100, 1000], [30, 200, 1000]]}
+    # an old peer that never sent gn, its totals are its card
+    old = {'cpu': 50, 'ram': 4.0, 'ram_total': 4.0, 'disk': 0, 'gpu': 90, 'vram': 10, 'vram_total': 100}
+    # no gpu at all
+    none = {'cpu': 0, 'ram': 1.0, 'ram_total': 4.0, 'disk': 0, 'gpu': 0, 'vram': 0, 'vram_total': 0, 'gpus': []}
+    merged = pc_server.merge_snapshots([one, two, old, none])
+    assert merged['cpu'] == round((10 + 31 + 50 + 0) / 4)
+    assert merged['ram'] == 8.2 and merged['ram_total'] == 32.0
+    assert merged['disk'] == 150 and merged['vram'] == 410 and merged['vram_total'] == 10100
+    assert merged['gpus'] == [[40, 100, 8000], [10, 100, 1000], [30, 200, 1000], [90, 10, 100]]
+    # gpu is the mean over cards, not peers
+    assert merged['gpu'] == round((40 + 10 + 30 + 90) / 4)
+    assert 'gn:4' in pc_server.format_frame(merged, ('gpus',))
+
+    many = pc_server.merge_snapshots([two] * (pc_server.MAX_GPUS))
+    assert len(many['gpus']) == pc_server.MAX_GPUS
+    empty = pc_server.merge_snapshots([])
+    assert empty['cpu'] == 0 and empty['gpus'] == []
+
+
+def relay_with(peers, view='cycle'):
+    '''A RelayCollector whose peers already have values, nothing is connected'''
+    relay = pc_server.RelayCollector([('peer{}'.format(i), 9002) for i in range(len(peers))], view)
+    for peer, values in zip(relay.peers, peers):
+        if values is not None:
+            peer.values = values
+            peer.last = pc_server.time.monotonic()
+    return relay
+
+
+def test_relay_one_card_peer():
+    values = {}
+    pc_server.parse_frame('cpu:5|ram:1.0/2.0|disk:0|gpu:40|vram:100/8000|gn:1|peak:0/0/0', values)
+    relay = relay_with([values])
+    snapshot = relay.sample()
+    assert snapshot['host'] == 1
+    assert pc_server.format_frame(snapshot, pc_server.MESSAGE_ORDER + ('gpus',)).endswith('|gn:1')
+    # a quiet peer is left out
+    relay.peers[0].last -= pc_server.PEER_TIMEOUT + 1
+    assert relay.sample()['host'] == 0
+    summary = relay_with([values, None], 'summary').sample()
+    assert summary['host'] == pc_server.RELAY_SUMMARY and summary['gpus'] == [[40, 100, 8000]]
+
+
+def delta_snapshot(**changes):
+    snapshot = {'cpu': 50, 'ram': 8.0, 'ram_total': 31.3, 'disk': 0, 'gpu': 50, 'vram': 1000, 'vram_total': 12282,
+                'gpus': [[50, 500, 6000], [50, 500, 6282]], 'cpu_max': 60, 'gpu_max': 60, 'disk_max': 0}
+    snapshot.update(changes)
+    return snapshot
+
+
+ORDER = pc_server.MESSAGE_ORDER + ('gpus', 'peak')
+
+
+def test_delta_thresholds():
+    delta = pc_server.DeltaFilter()
+    now = 100.0
+    # nothing sent yet, everything goes
+    assert delta.changed(delta_snapshot(), now, ORDER) == ORDER
+    delta.mark(delta_snapshot(), ORDER, now)
+    assert delta.changed(delta_snapshot(), now + 1, ORDER) == ()
+    # at the threshold isn't past it
+    assert delta.changed(delta_snapshot(cpu=52, ram=8.1, vram=1064, disk=64 * 1024), now + 1, ORDER) == ()
+    assert delta.changed(delta_snapshot(cpu=53), now + 1, ORDER) == ('cpu',)
+    assert delta.changed(delta_snapshot(cpu=47, vram=900), now + 1, ORDER) == ('cpu', 'vram')
+    assert delta.changed(delta_snapshot(ram_total=16.0), now + 1, ORDER) == ('ram',)
+    # per card, and the count
+    assert delta.changed(delta_snapshot(gpus=[[53, 500, 6000], [50, 500, 6282]]), now + 1, ORDER) == ('gpus',)
+    assert delta.changed(delta_snapshot(gpus=[[52, 564, 6000], [50, 500, 6282]]), now + 1, ORDER) == ()
+    assert delta.changed(delta_snapshot(gpus=[[50, 500, 6000]]), now + 1, ORDER) == ('gpus',)
+    # peaks go by their metric's threshold, and missing ones are 0
+    assert delta.changed(delta_snapshot(cpu_max=62), now + 1, ORDER) == ()
+    assert delta.changed(delta_snapshot(gpu_max=63), now + 1, ORDER) == ('peak',)
+    no_peaks = delta_snapshot()
+    del no_peaks['cpu_max'], no_peaks['gpu_max'], no_peaks['disk_max']
+    assert delta.changed(no_peaks, now + 1, ORDER) == ('peak',)
+    # small moves add up against what was last sent, not the last snapshot
+    delta.mark(delta_snapshot(cpu=52), ('cpu',), now + 1)
+    assert delta.changed(delta_snapshot(cpu=55), now + 2, ORDER) == ('cpu',)
+
+
+def test_delta_heartbeat_and_host():
+    delta = pc_server.DeltaFilter(heartbeat=5.0)
+    delta.mark(delta_snapshot(), ORDER, 100.0)
+    assert delta.changed(delta_snapshot(), 104.9, ORDER) == ()
+    assert delta.changed(delta_snapshot(), 105.0, ORDER) == ORDER
+    # only a send resets the heartbeat
+    delta.mark(delta_snapshot(cpu=60), ('cpu',), 104.0)
+    assert delta.changed(delta_snapshot(cpu=60), 108.9, ORDER) == ()
+    assert delta.changed(delta_snapshot(cpu=60), 109.0, ORDER) == ORDER
+    # a relay moving on to another machine sends everything, even if it looks the same
+    assert delta.changed(delta_snapshot(cpu=60, host=2), 105.0, ORDER) == ORDER
+    delta.mark(delta_snapshot(cpu=60, host=2), ORDER, 105.0)
+    assert delta.changed(delta_snapshot(cpu=60, host=2), 106.0, ORDER) == ()
+    assert delta.changed(delta_snapshot(cpu=60), 106.0, ORDER) == ORDER
+
+
+def test_delta_tick_payload():
+    '''bin records always carry everything, frames only what moved'''
+    snapshot = delta_snapshot()
+    delta = pc_server.DeltaFilter()
+    first = pc_server.tick_payload(pc_server.TickEncoder(1, snapshot), 'frame', 0, delta, 3)
+    assert first.startswith(b'cpu:50|ram:') and b'|gn:2|' in first and b'peak:60/60/0' in first
+    assert pc_server.tick_payload(pc_server.TickEncoder(2, snapshot), 'frame', 0, delta, 3) is None
+    moved = pc_server.tick_payload(pc_server.TickEncoder(3, delta_snapshot(cpu=90)), 'frame', 0, delta, 3)
+    assert moved == b'cpu:90\r\n'
+    delta = pc_server.DeltaFilter()
+    pc_server.tick_payload(pc_server.TickEncoder(1, snapshot), 'bin', 0, delta, 3)
+    record = pc_server.tick_payload(pc_server.TickEncoder(2, delta_snapshot(cpu=90)), 'bin', 0, delta, 3)
+    assert len(record) == pc_server.BIN_SIZE + 2 * pc_server.GPU_SIZE + pc_server.PEAK_SIZE
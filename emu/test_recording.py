@@ -0,0 +1,183 @@
+# test_recording.py - round trips through recording.py, the --record/--replay file format.
+#
+#   python -m pytest emu
+#
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+import recording  # noqa: E402
+
+
+def snapshot(n, gpus=2):
+    '''A Collector like snapshot that changes with n'''
+    return {
+        'time': 1000.0 + n, 'cpu': n % 100, 'ram': 8.3 + n / 10, 'ram_total': 31.3, 'disk': 1000 * n,
+        'disk_read': 10 * n, 'disk_write': 20 * n, 'net_rx': 5 * n, 'net_tx': 6 * n, 'gpu': 50,
+        'vram': 2000 + n, 'vram_total': 12282, 'host': 0,
+        'gpus': [[10 + i, 100 * n + i, 12282] for i in range(gpus)],
+    }
+
+
+def record(path, snapshots, **kwargs):
+    recorder = recording.Recorder(str(path), **kwargs)
+    for s in snapshots:
+        recorder.write(s)
+    recorder.close()
+    return recorder
+
+
+def read_all(path):
+    rec = recording.Recording(str(path))
+    try:
+        return [rec[n] for n in range(len(rec))]
+    finally:
+        rec.close()
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    written = [snapshot(n) for n in range(10)]
+    record(path, written, max_gpus=4)
+    back = read_all(path)
+    assert len(back) == 10
+    for s, (recorded, r) in zip(written, back):
+        assert recorded == s['time']
+        assert r['cpu'] == s['cpu'] and r['disk'] == s['disk'] and r['vram'] == s['vram']
+        assert r['ram'] == round(s['ram'], 1) and r['ram_total'] == 31.3
+        assert r['gpus'] == s['gpus']
+        assert r['disks'] == {}
+
+
+def test_missing_keys_are_nan(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    # no peaks (no --sample-rate), no host, one gpu
+    s = snapshot(1, gpus=1)
+    del s['host']
+    recorder = record(path, [s], max_gpus=2)
+    raw = recorder.record.unpack_from(open(str(path), 'rb').read(), recording.HEADER_SIZE)
+    values = dict(zip((name for name, kind in recorder.fields), raw[1:]))
+    assert math.isnan(values['cpu_max']) and math.isnan(values['host'])
+    assert values['gpu_count'] == 1 and math.isnan(values['g1_util'])
+    recorded, r = read_all(path)[0]
+    assert 'cpu_max' not in r and 'host' not in r
+    assert r['gpus'] == s['gpus']
+
+
+def test_more_gpus_than_slots(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    record(path, [snapshot(1, gpus=3)], max_gpus=2)
+    assert read_all(path)[0][1]['gpus'] == snapshot(1, gpus=3)['gpus'][:2]
+
+
+def test_no_gpus(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    record(path, [snapshot(1, gpus=0)], max_gpus=2)
+    assert read_all(path)[0][1]['gpus'] == []
+
+
+def record_size(max_gpus=1):
+    return 8 + 4 * len(recording.make_fields(max_gpus))
+
+
+@pytest.mark.parametrize('keep', [0, 1, 3])
+def test_rotation(tmp_path, keep):
+    path = tmp_path / 'stats.lcr'
+    # three records a file
+    max_bytes = recording.HEADER_SIZE + 3 * record_size()
+    record(path, [snapshot(n) for n in range(20)], max_bytes=max_bytes, keep=keep, max_gpus=1)
+    files = recording.rotated_files(str(path))
+    assert files == ['{}.{}'.format(path, i) for i in range(keep, 0, -1)] + [str(path)]
+    assert not os.path.exists('{}.{}'.format(path, keep + 1))
+    for f in files:
+        assert os.path.getsize(f) <= max_bytes
+    # oldest first and nothing out of order, the newest 3 * keep + 2 records are all there
+    times = [recorded for f in files for recorded, s in read_all(f)]
+    assert times == [1000.0 + n for n in range(20 - len(times), 20)]
+    assert len(times) == 3 * keep + 2
+
+
+def test_reopen_truncated_record(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    record(path, [snapshot(n) for n in range(3)], max_gpus=1)
+    # a crash half way through the 4th
+    with open(str(path), 'ab') as f:
+        f.write(b'\x01' * (record_size() // 2))
+    record(path, [snapshot(n) for n in range(3, 5)], max_gpus=1)
+    assert os.path.getsize(str(path)) == recording.HEADER_SIZE + 5 * record_size()
+    assert [s['cpu'] for recorded, s in read_all(path)] == [0, 1, 2, 3, 4]
+    assert recording.rotated_files(str(path)) == [str(path)]
+
+
+def test_header_mismatch_rotates(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    # recorded with other fields, kept as it is and a new file started
+    record(path, [snapshot(n) for n in range(2)], max_gpus=1)
+    record(path, [snapshot(n) for n in range(2, 5)], max_gpus=2)
+    assert [s['cpu'] for recorded, s in read_all('{}.1'.format(path))] == [0, 1]
+    assert [s['cpu'] for recorded, s in read_all(path)] == [2, 3, 4]
+    # and something that isn't a recording at all
+    other = tmp_path / 'notes.txt'
+    other.write_bytes(b'hello')
+    record(other, [snapshot(0)], max_gpus=1)
+    assert open('{}.1'.format(other), 'rb').read() == b'hello'
+    assert len(read_all(other)) == 1
+
+
+def test_empty_and_broken_files(tmp_path):
+    empty = tmp_path / 'empty.lcr'
+    empty.write_bytes(b'')
+    with pytest.raises(ValueError):
+        recording.Recording(str(empty))
+    junk = tmp_path / 'junk.lcr'
+    junk.write_bytes(b'x' * recording.HEADER_SIZE)
+    with pytest.raises(ValueError):
+        recording.Recording(str(junk))
+    header_only = tmp_path / 'header.lcr'
+    header_only.write_bytes(recording.make_header(recording.make_fields(1)))
+    assert read_all(header_only) == []
+
+
+def test_dtype_matches_record(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    record(path, [snapshot(1)], max_gpus=1)
+    rec = recording.Recording(str(path))
+    try:
+        dtype = rec.dtype()
+        assert dtype[0] == ('time', '<f8') and len(dtype) == len(rec.fields) + 1
+        assert 8 + 4 * (len(dtype) - 1) == rec.record_size
+    finally:
+        rec.close()
+
+
+def replay(paths):
+    '''Everything ReplaySource would publish for paths, as fast as it can'''
+    source = recording.ReplaySource([str(p) for p in paths], speed=1e9)
+    published = []
+    source.publish = published.append
+    return source.play(), published
+
+
+def test_replay(tmp_path):
+    path = tmp_path / 'stats.lcr'
+    record(path, [snapshot(n) for n in range(8)], max_bytes=recording.HEADER_SIZE + 3 * record_size(), keep=3, max_gpus=1)
+    empty = tmp_path / 'empty.lcr'
+    empty.write_bytes(b'')
+    # an empty file in the middle is skipped, not the end of the replay
+    files = recording.rotated_files(str(path))
+    played, published = replay(files[:1] + [empty] + files[1:])
+    assert played == 8
+    assert [s['recorded'] for s in published] == [1000.0 + n for n in range(8)]
+    assert [s['cpu'] for s in published] == list(range(8))
+
+
+def test_replay_nothing(tmp_path):
+    empty = tmp_path / 'empty.lcr'
+    empty.write_bytes(b'')
+    source = recording.ReplaySource([str(empty)], loop=True)
+    # with nothing playable it gives up instead of looping forever
+    source.run()
+    assert source.seq == 0
@@ -0,0 +1,211 @@
+# gpu_provider.py
+# GPU telemetry backends for pc_server.py
+# every provider gets all the fields in one query and none of them spawn a process per sample.
+#  - nvml: NVIDIA through the pynvml binding (pip install nvidia-ml-py), cheapest if installed
+#  - nvidia-smi: one long-lived 'nvidia-smi -lms' process streaming csv lines, read by a thread
+#  - sysfs: AMD (amdgpu) and Intel cards through /sys/class/drm, no extra packages
+#  - fake: canned values, for testing without a gpu
+#  - none: no gpu, always empty
+#
+import glob
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+# utilization is percent, memory is MiB (same units nvidia-smi reports)
+GpuSample = namedtuple('GpuSample', ('index', 'util', 'mem_used', 'mem_total'))
+
+PROVIDER_NAMES = ('auto', 'nvml', 'nvidia-smi', 'sysfs', 'fake', 'none')
+
+
+class GpuProvider:
+    '''Base provider, reports no gpus'''
+    name = 'none'
+
+    def read(self):
+        '''Return a list of GpuSample, one per gpu, ordered by index'''
+        return []
+
+    def close(self):
+        pass
+
+
+class NvmlProvider(GpuProvider):
+    '''NVIDIA gpus through NVML, no process involved at all'''
+    name = 'nvml'
+
+    def __init__(self):
+        import pynvml  # optional dependency, ImportError means use something else
+        self.nvml = pynvml
+        pynvml.nvmlInit()
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def read(self):
+        samples = []
+        for i, handle in enumerate(self.handles):
+            util = self.nvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            mem = self.nvml.nvmlDeviceGetMemoryInfo(handle)
+            samples.append(GpuSample(i, int(util), mem.used // (1024 * 1024), mem.total // (1024 * 1024)))
+        return samples
+
+    def close(self):
+        self.nvml.nvmlShutdown()
+
+
+class NvidiaSmiProvider(GpuProvider):
+    '''
+    Keeps one 'nvidia-smi --query-gpu=... -lms' process running and parses its csv stream
+    in a background thread. read() only returns the latest parsed line for each gpu.
+    '''
+    name = 'nvidia-smi'
+    QUERY = 'index,utilization.gpu,memory.used,memory.total'
+
+    def __init__(self, interval=0.25):
+        if shutil.which('nvidia-smi') is None:
+            raise FileNotFoundError('nvidia-smi not found')
+        self.interval_ms = max(int(interval * 1000), 100)
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.proc = None
+        self.running = True
+        self.thread = threading.Thread(target=self.reader, daemon=True)
+        self.thread.start()
+
+    def parse_line(self, line):
+        '''Parse one csv line, returns a GpuSample or None for anything unexpected'''
+        fields = [f.strip() for f in line.split(',')]
+        if len(fields) != 4:
+            return None
+        try:
+            index, util, used, total = (int(float(f)) for f in fields)
+        except ValueError:
+            # '[N/A]' or '[Not Supported]' on some cards
+            return None
+        return GpuSample(index, util, used, total)
+
+    def reader(self):
+        while self.running:
+            try:
+                self.proc = subprocess.Popen(
+                    ['nvidia-smi', '--query-gpu=' + self.QUERY, '--format=csv,noheader,nounits',
+                     '-lms', str(self.interval_ms)],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+                for line in self.proc.stdout:
+                    sample = self.parse_line(line)
+                    if sample is not None:
+                        with self.lock:
+                            self.samples[sample.index] = sample
+                self.proc.wait()
+            except Exception as e:
+                print('nvidia-smi reader error:', e)
+            # only gets here if nvidia-smi died, don't hammer it
+            if self.running: time.sleep(5)
+
+    def read(self):
+        with self.lock:
+            return [self.samples[i] for i in sorted(self.samples)]
+
+    def close(self):
+        self.running = False
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+
+
+class SysfsProvider(GpuProvider):
+    '''
+    AMD and Intel gpus through /sys/class/drm. Files are kept open and re-read from 0.
+    amdgpu exposes busy percent and vram directly. i915/xe don't have a busy percent,
+    so actual/max clock is used as a rough load figure and memory is left at 0.
+    '''
+    name = 'sysfs'
+
+    def __init__(self, root='/sys/class/drm'):
+        self.cards = []
+        for card in sorted(glob.glob(os.path.join(root, 'card[0-9]*'))):
+            if '-' in os.path.basename(card):
+                # connectors like card0-HDMI-A-1
+                continue
+            device = os.path.join(card, 'device')
+            busy = self.open(os.path.join(device, 'gpu_busy_percent'))
+            if busy is not None:
+                self.cards.append(('amd', busy,
+                                   self.open(os.path.join(device, 'mem_info_vram_used')),
+                                   self.open(os.path.join(device, 'mem_info_vram_total'))))
+                continue
+            act = self.open(os.path.join(card, 'gt_act_freq_mhz'))
+            rp0 = self.open(os.path.join(card, 'gt_RP0_freq_mhz'))
+            if act is not None and rp0 is not None:
+                self.cards.append(('intel', act, rp0, None))
+        if not self.cards:
+            raise FileNotFoundError('no amdgpu or intel gpu in ' + root)
+
+    def open(self, path):
+        try:
+            return open(path, 'rb', buffering=0)
+        except OSError:
+            return None
+
+    def value(self, f):
+        if f is None:
+            return 0
+        f.seek(0)
+        try:
+            return int(f.read())
+        except ValueError:
+            return 0
+
+    def read(self):
+        samples = []
+        for i, (kind, a, b, c) in enumerate(self.cards):
+            if kind == 'amd':
+                samples.append(GpuSample(i, self.value(a), self.value(b) // (1024 * 1024), self.value(c) // (1024 * 1024)))
+            else:
+                max_freq = self.value(b)
+                util = (self.value(a) * 100) // max_freq if max_freq else 0
+                samples.append(GpuSample(i, util, 0, 0))
+        return samples
+
+    def close(self):
+        for card in self.cards:
+            for f in card[1:]:
+                if f is not None: f.close()
+
+
+class FakeGpuProvider(GpuProvider):
+    '''
+    Canned values for testing. samples is a list of frames, each a list of
+    (util, mem_used, mem_total) per gpu; read() steps through the frames and wraps.
+    '''
+    name = 'fake'
+
+    def __init__(self, samples=None):
+        if samples is None:
+            samples = [[(0, 0, 12282)]]
+        self.frames = [[GpuSample(i, *gpu) for i, gpu in enumerate(frame)] for frame in samples]
+        self.pos = 0
+
+    def read(self):
+        frame = self.frames[self.pos]
+        self.pos = (self.pos + 1) % len(self.frames)
+        return frame
+
+
+def get_provider(name='auto', interval=0.25):
+    '''Create a provider by name. auto tries nvml, nvidia-smi, then sysfs, then gives up to none'''
+    match name:
+        case 'nvml': return NvmlProvider()
+        case 'nvidia-smi': return NvidiaSmiProvider(interval)
+        case 'sysfs': return SysfsProvider()
+        case 'fake': return FakeGpuProvider()
+        case 'none': return GpuProvider()
+        case 'auto':
+            for make in (NvmlProvider, lambda: NvidiaSmiProvider(interval), SysfsProvider):
+                try:
+                    return make()
+                except Exception:
+                    pass
+            return GpuProvider()
+    raise ValueError('unknown gpu provider: ' + name)
@@ -11,7 +11,14 @@ import time
 from machine import Pin, SPI, I2C
 import sys
 import select
+import struct
+import random
 import _thread
+from array import array
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio  # micropython before 1.21
 from wifi_settings import WIFI_SSID, WIFI_PASSWORD
 from ssd1306 import SSD1306_I2C
 
@@ -26,11 +33,143 @@ C_DEBUG = False
 PC_IP = '192.168.1.201'
 PC_PORT = 9002
 
+# 'tcp': connect to PC_IP:PC_PORT. 'udp': listen for pc_server --udp datagrams on C_UDP_PORT,
+# no connection and nothing to reconnect. C_UDP_GROUP is the multicast group to join, None for broadcast.
+C_TRANSPORT = 'tcp'
+C_UDP_PORT = 9003
+C_UDP_GROUP = None
+# datagrams with a seq older than the last one are dropped, unless this many in a row are
+# (the server restarted and its seq went back to 0)
+C_UDP_RESYNC = 20
+
+# True: network and parsing, and drawing, are asyncio tasks. Data is drawn as soon as it's
+# parsed, and the display keeps going (NO LINK and a counter on the bottom row) while it
+# reconnects in the background. False: the older get_data and display_updater threads.
+# udp always uses the threads.
+C_ASYNC = True
+
+# Protocol to ask the server for on connect: 'bin', 'frame' or 'lines'.
+# 'lines' sends no hello, for servers older than the handshake. An old server just ignores
+# the hello and keeps sending lines, which still get parsed.
+C_PROTOCOL = 'bin'
+# version 2 gets each gpu separately as well as the totals, on a box with more than one,
+# version 3 also the peaks when the server runs with --sample-rate
+C_PROTOCOL_VERSION = 3
+
+# binary record from pc_server, after the 2 byte 'LC' magic:
+# version, flags, seq, cpu %, gpu %, ram used/total in tenths of GB, vram used/total MiB, disk bytes/s
+C_BIN_VERSION = 1
+C_BIN_FORMAT = '<BBHBBHHIII'
+C_BIN_SIZE = 24
+C_BIN_MAGIC0 = 0x4C  # L
+C_BIN_MAGIC1 = 0x43  # C
+# per gpu record after the 'LG' magic: version, index, gpu count, utilization %, reserved, vram used/total MiB
+C_GPU_FORMAT = '<BBBBHII'
+C_GPU_SIZE = 16
+C_GPU_MAGIC1 = 0x47  # G
+# peaks record after the 'LP' magic: version, cpu max %, gpu max %, reserved, disk max bytes/s
+C_PEAK_FORMAT = '<BBBBI'
+C_PEAK_SIZE = 10
+C_PEAK_MAGIC1 = 0x50  # P
+
+# Nothing at all from the server for this long means the link is dead, reconnect.
+# pc_server --delta still sends a full update every 5s, so this is 3 missed heartbeats.
+C_LINK_TIMEOUT_MS = 15000
+
+# reconnecting to the pc server: the first retry is after about C_RETRY_MIN_MS, doubling each
+# failed attempt up to C_RETRY_FAST_MS, so a server restart (cronjob.sh) is back within a second.
+# once it's been gone C_RETRY_SLOW_AFTER_MS (pc off) it's up to C_RETRY_MAX_MS instead. each wait
+# is a random 50-100% of that, so a room full of picos doesn't hit a restarted server all at once.
+C_RETRY_MIN_MS = 100
+C_RETRY_FAST_MS = 1000
+C_RETRY_SLOW_AFTER_MS = 60000
+C_RETRY_MAX_MS = 20000
+
+# receive buffer, allocated once. tcp can split or join records anywhere, so anything
+# incomplete at the end of a recv stays at the front of the buffer for the next one.
+C_RECV_SIZE = 512
+recv_buf = bytearray(C_RECV_SIZE)
+recv_mv = memoryview(recv_buf)
+
+# metric slots, everything received is written into the metrics array at these indexes
+M_CPU = 0
+M_RAM = 1
+M_RAM_TOTAL = 2
+M_DISK = 3
+M_GPU = 4
+M_VRAM = 5
+M_VRAM_TOTAL = 6
+# multi gpu boxes: how many cards, then util, vram used, vram total for each card.
+# M_GPU/M_VRAM above are the server's totals over all of them.
+C_MAX_GPUS = 4
+M_GPU_COUNT = 7
+M_GPUS = 8
+# which machine a pc_server --relay is showing: 0 not a relay, 1.. that peer, C_HOST_ALL all of them
+M_HOST = M_GPUS + 3 * C_MAX_GPUS
+# highest cpu, gpu and disk in the server's last window (pc_server --sample-rate), all 0 without it
+M_CPU_PEAK = M_HOST + 1
+M_GPU_PEAK = M_HOST + 2
+M_DISK_PEAK = M_HOST + 3
+M_COUNT = M_HOST + 4
+C_HOST_ALL = 255
+# get_data parses into metrics (only its thread touches it), then publish() copies a finished
+# set into latest under data_lock. display_updater copies latest out under the same lock, so
+# neither side ever sees half an update.
+metrics = array('f', [0.0] * M_COUNT)
+latest = array('f', [0.0] * M_COUNT)
+data_lock = _thread.allocate_lock()
+# held while there's nothing new to draw, display_updater blocks on it and publish() releases it
+new_data = _thread.allocate_lock()
+new_data.acquire()
+# the same for the asyncio client, an asyncio.Event made by async_main
+data_ready = None
+# what the bottom row says while there's no data: 'WIFI', 'NO LINK', None once data is flowing.
+# link_since is when it went down, for the counter next to it.
+link_status = 'WIFI'
+link_since = 0
+
+# fastest the display will redraw, it only redraws when new data arrives anyway
+C_FRAME_TIME = 0.1
+
+def key_hash(key):
+    '''Small int hash of a metric name, so a name in the receive buffer can be looked up without making a string'''
+    h = 0
+    for c in key:
+        if 65 <= c <= 90: c += 32  # lower case
+        h = (h * 31 + c) & 0xFFFFFF
+    return h
+
+# name -> slots for value[/value]. hello is the server's answer to our hello, not a metric.
+C_HELLO = ()
+C_HOST_SLOTS = (M_HOST,)
+C_KEY_SLOTS = {
+    key_hash(b'cpu'): (M_CPU,),
+    key_hash(b'ram'): (M_RAM, M_RAM_TOTAL),
+    key_hash(b'disk'): (M_DISK,),
+    key_hash(b'gpu'): (M_GPU,),
+    key_hash(b'vram'): (M_VRAM, M_VRAM_TOTAL),
+    key_hash(b'hello'): C_HELLO,
+    key_hash(b'gn'): (M_GPU_COUNT,),
+    key_hash(b'host'): C_HOST_SLOTS,
+    key_hash(b'peak'): (M_CPU_PEAK, M_GPU_PEAK, M_DISK_PEAK),
+}
+for card in range(C_MAX_GPUS):
+    C_KEY_SLOTS[key_hash('g{}'.format(card).encode())] = (M_GPUS + card * 3, M_GPUS + card * 3 + 1, M_GPUS + card * 3 + 2)
+
 # I2C pins
 C_SDA = 0
 C_SCL = 1
 C_FREQ = 400000
 
+# with more than one gpu: 'aggregate' shows the totals only, 'pages' shows the totals and then
+# each card in turn on the GPU/VRAM rows, C_GPU_PAGE_MS each. pages only turn when data arrives.
+C_GPU_VIEW = 'pages'
+C_GPU_PAGE_MS = 3000
+
+# with peaks from the server: a small tick under the CPU and GPU bars at the window's highest,
+# and the disk figure is the highest rather than the average (disk is all bursts)
+C_SHOW_PEAKS = True
+
 # bar graph dimensions
 C_BAR_WIDTH = 80
 C_BAR_HEIGHT = 10
@@ -76,20 +215,38 @@ def connect_wifi():
 
     print('Connected to WiFi')
     print('IP address:', wlan.ifconfig()[0])
+    if C_TRANSPORT == 'udp':
+        # nothing to connect to, get_data_udp just listens
+        return wlan
     
-    # Connect to PC server - retry forever every 20 seconds
+    # Connect to PC server - retry forever, backing off up to C_RETRY_MAX_MS
     sock = None
+    attempt = 0
+    down_since = time.ticks_ms()
     while True:
         sock = connect_to_pc()
         if sock is not None:
             break
-        print('Failed to connect to PC server, retrying in 20 seconds...')
-        time.sleep(20)
+        delay = retry_delay(attempt, down_since)
+        attempt += 1
+        print('Failed to connect to PC server, retrying in {:.1f} seconds...'.format(delay))
+        time.sleep(delay)
 
     print('Connected to PC server, ready to receive data...')
 
     return wlan
 
+def retry_delay(attempt, down_since):
+    '''
+    Seconds to wait before reconnect attempt number attempt (0 is the first retry), jittered
+    exponential backoff. down_since is the ticks_ms the server went away.
+    '''
+    limit = C_RETRY_FAST_MS
+    if time.ticks_diff(time.ticks_ms(), down_since) >= C_RETRY_SLOW_AFTER_MS:
+        limit = C_RETRY_MAX_MS
+    delay = min(C_RETRY_MIN_MS << min(attempt, 16), limit)
+    return (delay // 2 + random.getrandbits(16) % (delay // 2 + 1)) / 1000
+
 def connect_to_pc():
     '''Connect to PC server'''
     global sock
@@ -103,6 +260,9 @@ def connect_to_pc():
         print('Connecting to PC server at {}:{}'.format(PC_IP, PC_PORT))
         sock.connect((PC_IP, PC_PORT))
         print('Connected to PC server')
+        if C_PROTOCOL != 'lines':
+            # ask for the preferred protocol, falling back to frame
+            sock.send('hello:{}:{},frame\r\n'.format(C_PROTOCOL_VERSION, C_PROTOCOL).encode())
         return sock
     except Exception as e:
         print('Failed to connect to PC server:', e)
@@ -138,150 +298,441 @@ def debug_output(output):
 
 
 
-def display_updater(display):
-    '''Function to continuously update the display'''
-    # Switch this to a buffer then blit
-    global cpu_usage
-    global ram_usage
-    global ram_total
-    global disk_usage
-    global gpu_usage
-    global vram_usage
-    global lock
+def clear_metrics(first, last):
+    '''Zero metrics[first:last], for slots the next data might not set (eg peaks from a server without them)'''
+    for i in range(first, last):
+        metrics[i] = 0
 
-    while True:
-        if not lock:
-            try:
-                #debug_output('Updating display...')
-                
-                #s_cpu_usage = str(cpu_usage)
-                #s_ram_usage = str(ram_usage)
-                #s_ram_total = str(ram_total)
-                
-                ram_total = round(ram_total)
-                ram_usage = round(ram_usage)
-                disk_usage = disk_usage / 1024
-                disk_usage = int(disk_usage)
-                cpu_usage = round(cpu_usage)
-                gpu_usage = round(gpu_usage)
-                vram_usage = round(vram_usage)
-
-                # Simple thread locking, to prevent get_data from calling before this is finished
-                lock = True
-                display.fill(0)
-
-                textpos = 0
-                display.text('CPU', 0, textpos)
-                pc_cpu = 0
-                if cpu_usage >= 0 and cpu_usage <= 100:
-                    pc_cpu = (cpu_usage / 100) * 100
-                    draw_bar_graph(display, pc_cpu-1, C_BAR_STARTX, textpos, C_BAR_WIDTH, C_BAR_HEIGHT, True)
-                
-                textpos = C_TEXT_VERTSPACE
-                display.text('RAM', 0, textpos)
-                pc_ram = 0
-                if (ram_usage > 0) and (ram_total > 0):
-                    pc_ram = (ram_usage / ram_total) * 100
-                    draw_bar_graph(display, pc_ram-1, C_BAR_STARTX, textpos, C_BAR_WIDTH, C_BAR_HEIGHT, True)
-                
-                textpos = C_TEXT_VERTSPACE * 2
-                #display.text('GPU: '+str(gpu_usage), 0, textpos)
-                display.text('GPU', 0, textpos)
-                if gpu_usage >= 0 and gpu_usage <= 100:
-                    draw_bar_graph(display, gpu_usage, C_BAR_STARTX, textpos, C_BAR_WIDTH, C_BAR_HEIGHT, True)
-
-
-                textpos = C_TEXT_VERTSPACE * 3
-                #display.text('VRAM: '+str(vram_usage), 0, textpos)
-                display.text('VRAM', 0, textpos)
-                pc_vram = 0
-                if (vram_usage >= 0) and (vram_total > 0):
-                    pc_vram = (vram_usage / vram_total) * 100
-                    draw_bar_graph(display, pc_vram-1, C_BAR_STARTX, textpos, C_BAR_WIDTH, C_BAR_HEIGHT, True)
-
-
-                textpos = C_TEXT_VERTSPACE * 4
-                display.text('Disk: '+str(disk_usage), 0, textpos)
-                
-                # bar graph disabled for now, until i work out the max throughput of my drives
-                #pc_disk = 0
-                #if disk_usage > 0:
-                #    pc_disk = (disk_usage / 10000) * 100
-                #draw_bar_graph(display, pc_disk-1, 40, 40, 80, 15, True)
-
-
-                display.show()
-                time.sleep(0.500)  # Update screen rate
-                lock = False
-                if not _thread.get_ident():  # If the thread has exited, this will be None
-                    break
-            except KeyboardInterrupt:
-                break
+def clear_server_metrics():
+    '''
+    Zero what belongs to one server, which another (or an older one) might not send: the gpu
+    count and cards, the relay host and the peaks
+    '''
+    clear_metrics(M_GPU_COUNT, M_COUNT)
+
+def publish():
+    '''Hand the parsed metrics to display_updater and wake it up'''
+    with data_lock:
+        for i in range(M_COUNT):
+            latest[i] = metrics[i]
+    if new_data.locked():
+        new_data.release()
+    if data_ready is not None:
+        data_ready.set()
+
+# the four bars, label and row
+C_BAR_LABELS = ('CPU', 'RAM', 'GPU', 'VRAM')
+# where the disk number goes, after the static 'Disk:' label
+C_DISK_X = 48
+C_DISK_Y = C_TEXT_VERTSPACE * 4
+# relay host, bottom right
+C_HOST_X = 104
+
+# screens display_updater cycles through, C_SCREEN_MS each. ('bars',) to never leave the bars.
+# 'history' is the last C_HISTORY updates of each bar as a strip of columns, newest on the right.
+C_SCREENS = ('bars', 'history')
+C_SCREEN_MS = 15000
+C_HISTORY = 128
+C_SPARK_HEIGHT = 16
+# one byte per sample (0-100) in a fixed ring per bar, history_pos is where the next one goes
+history = [array('B', bytes(C_HISTORY)) for row in range(len(C_BAR_LABELS))]
+history_pos = 0
+
+def draw_static(display, bar_widths):
+    '''
+    Draw everything that never changes: labels, empty bar boxes and scale markers.
+    Done once, after that display_updater only draws the change in each bar.
+    '''
+    display.fill(0)
+    for row in range(len(C_BAR_LABELS)):
+        textpos = C_TEXT_VERTSPACE * row
+        display.text(C_BAR_LABELS[row], 0, textpos)
+        bar_widths[row] = draw_bar_graph(display, 0, C_BAR_STARTX, textpos, C_BAR_WIDTH, C_BAR_HEIGHT, True)
+    display.text('Disk:', 0, C_DISK_Y)
+
+def draw_gpu_labels(display, page):
+    '''Relabel the GPU and VRAM rows, page 0 is the totals, page n is card n-1'''
+    for row in (2, 3):
+        textpos = C_TEXT_VERTSPACE * row
+        display.fill_rect(0, textpos, C_BAR_STARTX, 8, 0)
+        if page == 0:
+            display.text(C_BAR_LABELS[row], 0, textpos)
         else:
-            debug_output('LOCK')
-
-def split_parts(data_recv):
-# micropython doesn't support match/case as of dec 2025
-    global cpu_usage
-    global ram_usage
-    global ram_total
-    global disk_usage
-    global gpu_usage
-    global vram_usage
-    global vram_total
-
-    data = data_recv.decode('utf-8')
-    data = str(data)
-    data = data.strip()
-    info, parts = '', ''
-    if ':' in data:
-        parts, info = data.split(':')
-    else:
-        info = ''
-        parts = ''
-
-    parts = parts.lower()
-    if parts == 'cpu':
-        cpu_usage = float(info)
-        debug_output('CPU usage: '+str(cpu_usage))
-        #print('CPU usage: '+str(cpu_usage))
-    elif parts == 'ram':
-        # ram contains used/total
-        try:        
-            ram_usage = float(info.split('/')[0])
-            ram_total = float(info.split('/')[1])
-        except:
-            ram_total = 10
-            ram_usage = 0
-        debug_output('RAM usage: {:.2f}GB/{:.2f}GB'.format(ram_usage, ram_total))
-        #print('RAM usage: {:.2f}GB/{:.2f}GB'.format(ram_usage, ram_total))
-    elif parts == 'disk':
-        disk_usage = float(info)
-        debug_output('Disk usage: '+str(disk_usage))
-        #print('Disk usage: '+str(disk_usage))
-    elif parts == 'gpu':
-        gpu_usage = float(info)
-        debug_output('GPU usage: '+str(gpu_usage))
-    elif parts == 'vram':
-        #vram_usage = float(info)
-        #debug_output('VRAM usage: '+str(vram_usage))
+            display.text(('GPU', 'VRM')[row - 2] + str(page - 1), 0, textpos)
+
+def history_add(values):
+    '''Put one sample of each bar (percent) into the history rings'''
+    global history_pos
+    for row in range(len(history)):
+        v = int(values[row])
+        history[row][history_pos] = 0 if v < 0 else (100 if v > 100 else v)
+    history_pos = (history_pos + 1) % C_HISTORY
+
+def draw_history_column(display, x, index):
+    '''Draw history sample index of every bar as column x, clearing what was there'''
+    for row in range(len(history)):
+        top = row * C_SPARK_HEIGHT
+        # top pixel row of each strip stays blank, it separates them
+        h = history[row][index] * (C_SPARK_HEIGHT - 1) // 100
+        display.vline(x, top, C_SPARK_HEIGHT, 0)
+        if h:
+            display.vline(x, top + C_SPARK_HEIGHT - h, h, 1)
+
+def draw_history_labels(display):
+    for row in range(len(history)):
+        display.fill_rect(0, row * C_SPARK_HEIGHT, len(C_BAR_LABELS[row]) * 8, 8, 0)
+        display.text(C_BAR_LABELS[row], 0, row * C_SPARK_HEIGHT)
+
+def draw_history(display):
+    '''Draw the whole history screen, only when switching to it'''
+    display.fill(0)
+    for x in range(display.width):
+        draw_history_column(display, x, (history_pos - display.width + x) % C_HISTORY)
+    draw_history_labels(display)
+
+def scroll_history(display):
+    '''Move the history screen on by the newest sample: scroll left one pixel and draw one column'''
+    display.scroll(-1, 0)
+    draw_history_column(display, display.width - 1, (history_pos - 1) % C_HISTORY)
+    # the labels scrolled too, put them back
+    draw_history_labels(display)
+
+def draw_peak(display, row, value, last_x):
+    '''Move the peak tick under bar row to value (0-99), returns its x, -1 for none'''
+    y = C_TEXT_VERTSPACE * row + C_BAR_HEIGHT
+    x = -1
+    if value > 0:
+        x = C_BAR_STARTX + int((min(value, 99) / 99.0) * (C_BAR_WIDTH - 1))
+    if x != last_x:
+        if last_x >= 0:
+            display.fill_rect(last_x - 1, y, 3, 2, 0)
+        if x >= 0:
+            display.pixel(x, y, 1)
+            display.hline(x - 1, y + 1, 3, 1)
+    return x
+
+class Renderer:
+    '''
+    What's on the display and how to move it on to the next update. Used by display_updater
+    (threads) and render_task (asyncio), the drawing is the same either way.
+    '''
+    def __init__(self, display):
+        self.display = display
+        # current fill width of each bar, and the disk figure on screen
+        self.bar_widths = array('h', [0] * len(C_BAR_LABELS))
+        self.bar_values = array('f', [0.0] * len(C_BAR_LABELS))
+        self.shown_disk = -1
+        self.shown_host = 0
+        # x of the cpu and gpu peak ticks, -1 when there isn't one
+        self.peak_x = array('h', [-1, -1])
+        self.gpu_page = 0
+        self.shown_page = 0
+        self.page_start = time.ticks_ms()
+        # link status text over the disk row, None when the link is up
+        self.shown_link = None
+        self.show_screen(0)
+
+    def show_screen(self, screen):
+        '''Switch to C_SCREENS[screen] and draw it in full'''
+        self.screen = screen
+        self.screen_start = time.ticks_ms()
+        if C_SCREENS[screen] == 'history':
+            draw_history(self.display)
+        else:
+            draw_static(self.display, self.bar_widths)
+            self.shown_disk = -1
+            self.shown_host = 0
+            self.shown_page = 0
+            self.shown_link = None
+            self.peak_x[0] = -1
+            self.peak_x[1] = -1
+
+    def draw_link(self, text):
+        '''Put text (eg 'NO LINK 12s') over the disk row while the link is down, None puts the row back'''
+        if text == self.shown_link or 'bars' not in C_SCREENS:
+            return
+        if C_SCREENS[self.screen] != 'bars':
+            # history doesn't move without data, go where the status can be seen
+            self.show_screen(C_SCREENS.index('bars'))
+        display = self.display
+        display.fill_rect(0, C_DISK_Y, display.width, 8, 0)
+        if text is None:
+            display.text('Disk:', 0, C_DISK_Y)
+            self.shown_disk = -1
+            self.shown_host = 0
+        else:
+            display.text(text, 0, C_DISK_Y)
+        self.shown_link = text
+
+    def draw(self, view):
+        '''Draw one update from view (a copy of latest), up to but not including show()'''
+        display = self.display
+        bar_values = self.bar_values
+        ram_total = round(view[M_RAM_TOTAL])
+        ram_usage = round(view[M_RAM])
+        disk_usage = int(view[M_DISK] / 1024)
+        if C_SHOW_PEAKS and view[M_DISK_PEAK] > 0:
+            disk_usage = int(view[M_DISK_PEAK] / 1024)
+        cpu_usage = round(view[M_CPU])
+        gpu_usage = round(view[M_GPU])
+        vram_usage = round(view[M_VRAM])
+        vram_total = view[M_VRAM_TOTAL]
+
+        gpu_count = min(int(view[M_GPU_COUNT]), C_MAX_GPUS)
+        if C_GPU_VIEW == 'pages' and gpu_count > 1:
+            if time.ticks_diff(time.ticks_ms(), self.page_start) >= C_GPU_PAGE_MS:
+                self.gpu_page = (self.gpu_page + 1) % (gpu_count + 1)
+                self.page_start = time.ticks_ms()
+        else:
+            self.gpu_page = 0
+        gpu_page = self.gpu_page
+
+        pc_cpu = 0
+        if cpu_usage >= 0 and cpu_usage <= 100:
+            pc_cpu = (cpu_usage / 100) * 100 - 1
+        
+        pc_ram = 0
+        if (ram_usage > 0) and (ram_total > 0):
+            pc_ram = (ram_usage / ram_total) * 100 - 1
         
-        # ram contains used/total
-        try:        
-            vram_usage = float(info.split('/')[0])
-            vram_total = float(info.split('/')[1])
-        except:
-            vram_total = 10
-            vram_usage = 0
-        debug_output('VRAM usage: {:.2f}GB/{:.2f}GB'.format(vram_usage, vram_total))
+        pc_gpu = 0
+        if gpu_usage >= 0 and gpu_usage <= 100:
+            pc_gpu = gpu_usage
+
+        pc_vram = 0
+        if (vram_usage >= 0) and (vram_total > 0):
+            pc_vram = (vram_usage / vram_total) * 100 - 1
+
+        bar_values[0] = pc_cpu
+        bar_values[1] = pc_ram
+        bar_values[2] = pc_gpu
+        bar_values[3] = pc_vram
+        # history is always the totals, whichever gpu page is up
+        history_add(bar_values)
+
+        if len(C_SCREENS) > 1 and time.ticks_diff(time.ticks_ms(), self.screen_start) >= C_SCREEN_MS:
+            self.show_screen((self.screen + 1) % len(C_SCREENS))
+        elif C_SCREENS[self.screen] == 'history':
+            scroll_history(display)
+
+        if C_SCREENS[self.screen] == 'bars':
+            if gpu_page != self.shown_page:
+                draw_gpu_labels(display, gpu_page)
+                self.shown_page = gpu_page
+            if gpu_page:
+                slot = M_GPUS + (gpu_page - 1) * 3
+                bar_values[2] = view[slot]
+                bar_values[3] = 0
+                if view[slot + 2] > 0:
+                    bar_values[3] = (view[slot + 1] / view[slot + 2]) * 100 - 1
+
+            # labels, boxes and scales are already on screen, only the bar fills and disk number change
+            bar_widths = self.bar_widths
+            for row in range(len(C_BAR_LABELS)):
+                bar_widths[row] = draw_bar_graph(display, bar_values[row], C_BAR_STARTX, C_TEXT_VERTSPACE * row,
+                                                 C_BAR_WIDTH, C_BAR_HEIGHT, True, bar_widths[row])
+            if C_SHOW_PEAKS:
+                self.peak_x[0] = draw_peak(display, 0, view[M_CPU_PEAK], self.peak_x[0])
+                # the peak is for the totals, not one card
+                self.peak_x[1] = draw_peak(display, 2, 0 if gpu_page else view[M_GPU_PEAK], self.peak_x[1])
+
+            if disk_usage != self.shown_disk:
+                display.fill_rect(C_DISK_X, C_DISK_Y, C_HOST_X - C_DISK_X, 8, 0)
+                display.text(str(disk_usage), C_DISK_X, C_DISK_Y)
+                self.shown_disk = disk_usage
+
+            host = int(view[M_HOST])
+            if host != self.shown_host:
+                display.fill_rect(C_HOST_X, C_DISK_Y, display.width - C_HOST_X, 8, 0)
+                if host == C_HOST_ALL:
+                    display.text('ALL', C_HOST_X, C_DISK_Y)
+                elif host:
+                    display.text('#' + str(host), C_HOST_X, C_DISK_Y)
+                self.shown_host = host
+        
+        # bar graph disabled for now, until i work out the max throughput of my drives
+        #pc_disk = 0
+        #if disk_usage > 0:
+        #    pc_disk = (disk_usage / 10000) * 100
+        #draw_bar_graph(display, pc_disk-1, 40, 40, 80, 15, True)
 
+def display_updater(display):
+    '''Function to continuously update the display'''
+    renderer = Renderer(display)
+    view = array('f', [0.0] * M_COUNT)
 
-    else:
-        debug_output('Unknown part:'+str(parts))
-        #print('Unknown part:', parts)
+    while True:
+        try:
+            # sleep until there's something new, no spinning
+            new_data.acquire()
+            with data_lock:
+                for i in range(M_COUNT):
+                    view[i] = latest[i]
+            renderer.draw(view)
+            display.show()
+            time.sleep(C_FRAME_TIME)  # cap the screen rate
+            if not _thread.get_ident():  # If the thread has exited, this will be None
+                break
+        except KeyboardInterrupt:
+            break
 
-    # returns for debugging    
-    return parts, info
+def parse_line(buf, start, end):
+    '''
+    Parse a line of name:value[/value] parts separated by | (one message or a whole frame)
+    straight out of buf[start:end] into the metrics array. No strings get made, names are
+    matched through key_hash and C_KEY_SLOTS. Unknown names are skipped.
+    '''
+    h = 0
+    i = start
+    while i < end:
+        c = buf[i]
+        if c == 58:  # ':' ends the name
+            slots = C_KEY_SLOTS.get(h)
+            if slots is None:
+                if C_DEBUG: debug_output('Unknown part: '+str(bytes(buf[start:end])))
+                while i < end and buf[i] != 124:
+                    i += 1
+            elif slots is C_HELLO:
+                print('Server protocol:', bytes(buf[start:end]))
+                return
+            elif slots is C_HOST_SLOTS:
+                # comes first in a frame, so the rest of it lands after the clear
+                host = metrics[M_HOST]
+                i = parse_value(buf, i + 1, end, slots)
+                if metrics[M_HOST] != host:
+                    host_changed(metrics[M_HOST])
+            else:
+                i = parse_value(buf, i + 1, end, slots)
+            h = 0
+        elif c == 124:  # '|' with no value
+            h = 0
+        elif c > 32:
+            if 65 <= c <= 90: c += 32
+            h = (h * 31 + c) & 0xFFFFFF
+        i += 1
+
+def parse_value(buf, i, end, slots):
+    '''Parse value[/value] from buf[i] into the metric slots, returns the index of the | or end'''
+    n = 0
+    num = 0
+    scale = 0
+    digits = False
+    while i < end:
+        c = buf[i]
+        if 48 <= c <= 57:
+            num = num * 10 + c - 48
+            if scale: scale *= 10
+            digits = True
+        elif c == 46:  # '.'
+            scale = 1
+        elif c == 47 or c == 124:  # '/' or '|'
+            if digits and n < len(slots):
+                metrics[slots[n]] = num / scale if scale else num
+            if c == 124:
+                return i
+            n += 1
+            num = 0
+            scale = 0
+            digits = False
+        i += 1
+    if digits and n < len(slots):
+        metrics[slots[n]] = num / scale if scale else num
+    return i
+
+def host_changed(host):
+    '''A relay moved on to another machine (or all of them), the last one's cards and peaks aren't this one's'''
+    clear_server_metrics()
+    metrics[M_HOST] = host
+
+def apply_record(buf, pos):
+    '''Unpack a binary record starting at buf[pos] (the magic) straight into the metrics'''
+    version, flags, seq, cpu, gpu, ram, ram_t, vram, vram_t, disk = struct.unpack_from(C_BIN_FORMAT, buf, pos + 2)
+    if version != C_BIN_VERSION:
+        debug_output('Unknown record version: '+str(version))
+        return
+    metrics[M_CPU] = cpu
+    metrics[M_GPU] = gpu
+    metrics[M_RAM] = ram / 10
+    metrics[M_RAM_TOTAL] = ram_t / 10
+    metrics[M_VRAM] = vram
+    metrics[M_VRAM_TOTAL] = vram_t
+    metrics[M_DISK] = disk
+    if flags != metrics[M_HOST]:
+        host_changed(flags)
+    if C_DEBUG: debug_output('Record: '+str(seq))
+
+def apply_gpu_record(buf, pos):
+    '''Unpack a per gpu record starting at buf[pos] (the magic) into that card's slots'''
+    version, index, count, util, _, used, total = struct.unpack_from(C_GPU_FORMAT, buf, pos + 2)
+    if version != C_BIN_VERSION or index >= C_MAX_GPUS:
+        return
+    metrics[M_GPU_COUNT] = count
+    slot = M_GPUS + index * 3
+    metrics[slot] = util
+    metrics[slot + 1] = used
+    metrics[slot + 2] = total
+
+def apply_peak_record(buf, pos):
+    '''Unpack a peaks record starting at buf[pos] (the magic)'''
+    version, cpu, gpu, _, disk = struct.unpack_from(C_PEAK_FORMAT, buf, pos + 2)
+    if version != C_BIN_VERSION:
+        return
+    metrics[M_CPU_PEAK] = cpu
+    metrics[M_GPU_PEAK] = gpu
+    metrics[M_DISK_PEAK] = disk
+
+def drain_recv(count):
+    '''
+    Handle every complete record in the first count bytes of recv_buf, binary records and
+    text lines can be mixed. Whatever is left over (a partial record) is moved to the front
+    of the buffer, returns how many bytes that is.
+    '''
+    pos = 0
+    parsed = False
+    while pos < count:
+        if recv_buf[pos] == C_BIN_MAGIC0 and (pos + 1 == count or recv_buf[pos + 1] == C_BIN_MAGIC1
+                                              or recv_buf[pos + 1] == C_GPU_MAGIC1 or recv_buf[pos + 1] == C_PEAK_MAGIC1):
+            if pos + 1 == count:
+                # can't tell which record yet
+                break
+            kind = recv_buf[pos + 1]
+            size = C_BIN_SIZE if kind == C_BIN_MAGIC1 else (C_GPU_SIZE if kind == C_GPU_MAGIC1 else C_PEAK_SIZE)
+            if count - pos < size:
+                # rest of the record is still on its way
+                break
+            if kind == C_BIN_MAGIC1:
+                apply_record(recv_buf, pos)
+            elif kind == C_GPU_MAGIC1:
+                apply_gpu_record(recv_buf, pos)
+            else:
+                apply_peak_record(recv_buf, pos)
+            pos += size
+            parsed = True
+            continue
+
+        end = pos
+        while end < count and recv_buf[end] != 10:
+            end += 1
+        if end == count:
+            # no newline yet
+            break
+        parse_line(recv_buf, pos, end)
+        pos = end + 1
+        parsed = True
+
+    if parsed:
+        # one handoff per recv, however many records were in it
+        publish()
+
+    left = count - pos
+    if left == C_RECV_SIZE:
+        # a whole buffer without a single record in it, it's junk
+        print('Receive buffer overflow, dropping', left, 'bytes')
+        return 0
+    # overlap is fine, copying forwards
+    for i in range(left):
+        recv_buf[i] = recv_buf[pos + i]
+    return left
 
 def close_sock():
     global sock
@@ -290,18 +741,10 @@ def close_sock():
         sock.close()
 
 
-def breakdown_recv_data(data):
-    recv_data = ''
-    recv_data_remainder = ''
-    recv_data = data.split(b'\n')[0]
-    recv_data_remainder = data.split(b'\n')[1]
-    return recv_data
-
 def get_data():
     global sock
-    buffer = ''
-    recv_data = ''
-    received_string = ''
+    recv_len = 0
+    last_recv = time.ticks_ms()
     try:
         while True:
             try:
@@ -314,31 +757,46 @@ def get_data():
                 readable, _, _ = select.select([sock], [], [], 0.2)  # Timeout of 0.5 seconds
 
                 if sock in readable:
-                    # Receive data from PC
-                    data = sock.recv(1024)
-                    if data:
-                        try:
-                            debug_output('Received data: '+str(split_parts(data)))
-                        except ValueError:
-                            print('Invalid data received:', data)
-                    else:
-                        # Empty data means server closed the connection
-                        print('Server closed connection')
+                    # Receive data from PC straight into the preallocated buffer, after any
+                    # partial record. keep going while there's more queued, so a burst after a
+                    # wifi hiccup is drained in one pass.
+                    while True:
+                        n = sock.readinto(recv_mv[recv_len:])
+                        if not n:
+                            # Empty data means server closed the connection
+                            raise OSError('Server closed connection')
+                        last_recv = time.ticks_ms()
+                        recv_len = drain_recv(recv_len + n)
+                        readable, _, _ = select.select([sock], [], [], 0)
+                        if not readable:
+                            break
+                elif time.ticks_diff(time.ticks_ms(), last_recv) > C_LINK_TIMEOUT_MS:
+                    # not even a heartbeat, the server or wifi has gone
+                    raise OSError('no data for {}ms'.format(C_LINK_TIMEOUT_MS))
 
                 # Small delay to prevent excessive CPU usage
                 time.sleep(0.05)
 
 
             except Exception as e:
+                close_sock()
                 sock = None  # Set sock to None to trigger reconnection attempt
                 print('Error receiving data:', e)
                 # Attempt to reconnect
                 sock = connect_to_pc()
+                attempt = 0
+                down_since = time.ticks_ms()
                 while sock is None:
-                    print('Failed to reconnect to PC server, retrying in 20 seconds...')
-                    time.sleep(20)
+                    delay = retry_delay(attempt, down_since)
+                    attempt += 1
+                    print('Failed to reconnect to PC server, retrying in {:.1f} seconds...'.format(delay))
+                    time.sleep(delay)
                     sock = connect_to_pc()
                 print('Reconnected to PC server')
+                # a different server (or the same one restarted) may not send these
+                clear_server_metrics()
+                recv_len = 0
+                last_recv = time.ticks_ms()
             
 
     except KeyboardInterrupt:
@@ -352,7 +810,177 @@ def get_data():
         close_sock()
 
 
-def draw_bar_graph(fbuf, value, x=0, y=0,box_width=127, box_height=20, show_scale=False):
+def open_udp():
+    '''Socket listening for pc_server --udp datagrams, joins C_UDP_GROUP if set'''
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    udp.bind(('0.0.0.0', C_UDP_PORT))
+    if C_UDP_GROUP:
+        # ip_mreq: group address then our address, there's no inet_aton here
+        local = network.WLAN(network.STA_IF).ifconfig()[0]
+        mreq = bytes([int(x) for x in C_UDP_GROUP.split('.')] + [int(x) for x in local.split('.')])
+        udp.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    print('Listening for udp on port {}'.format(C_UDP_PORT))
+    return udp
+
+def get_data_udp():
+    '''
+    Receive loop for C_TRANSPORT = 'udp'. Every datagram is a whole snapshot (a bin record and
+    maybe per gpu records), so there's no reassembly: it's applied or dropped as a unit.
+    '''
+    global sock
+    sock = open_udp()
+    last_seq = -1
+    stale = 0
+    last_recv = time.ticks_ms()
+    quiet = False
+    try:
+        while True:
+            readable, _, _ = select.select([sock], [], [], 0.2)
+            if sock in readable:
+                n = sock.readinto(recv_mv)
+                if n < C_BIN_SIZE or recv_buf[0] != C_BIN_MAGIC0 or recv_buf[1] != C_BIN_MAGIC1:
+                    continue
+                seq = recv_buf[4] | (recv_buf[5] << 8)
+                # newer means up to half the 16 bit seq range ahead, with wraparound
+                ahead = (seq - last_seq) & 0xFFFF
+                if last_seq >= 0 and (ahead == 0 or ahead >= 0x8000) and stale < C_UDP_RESYNC:
+                    stale += 1
+                    debug_output('Dropped stale datagram: '+str(seq))
+                    continue
+                stale = 0
+                last_seq = seq
+                last_recv = time.ticks_ms()
+                if quiet:
+                    print('udp data again')
+                    quiet = False
+                # each datagram is the whole snapshot, no LG or LP records in it means no cards or peaks
+                clear_server_metrics()
+                drain_recv(n)
+            elif not quiet and time.ticks_diff(time.ticks_ms(), last_recv) > C_LINK_TIMEOUT_MS:
+                # nothing to reconnect, just keep listening
+                print('No udp data for {}ms'.format(C_LINK_TIMEOUT_MS))
+                quiet = True
+    except KeyboardInterrupt:
+        print('Stopping...')
+        close_sock()
+
+async def connect_wifi_async():
+    '''connect_wifi for the asyncio client, it waits with asyncio.sleep so the display keeps going'''
+    print('setup connecting to wifi')
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    retry_count = 0
+    while not wlan.isconnected():
+        print('Attempting to connect to WiFi: ' + WIFI_SSID)
+        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+        # Wait up to 10 seconds for connection
+        for wait_time in range(10):
+            if wlan.status() < 0 or wlan.status() >= 3:
+                break
+            await asyncio.sleep(1)
+        if wlan.status() != 3:
+            retry_count += 1
+            delay = 10 if retry_count == 1 else 30
+            print('Failed to connect to WiFi. Retrying in {} seconds...'.format(delay))
+            await asyncio.sleep(delay)
+    print('Connected to WiFi')
+    print('IP address:', wlan.ifconfig()[0])
+    return wlan
+
+async def stream_readinto(stream, buf):
+    '''Read into buf from an asyncio stream, returns the byte count (0 when the server closed)'''
+    if hasattr(stream, 'readinto'):
+        return await stream.readinto(buf)
+    # no readinto on this asyncio (emu on cpython), copy in
+    data = await stream.read(len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+async def net_task():
+    '''
+    Connect, read and parse for the asyncio client. Each read waits on the socket (no polling),
+    whatever arrived is parsed straight away and publish() wakes render_task.
+    '''
+    global link_status, link_since
+    attempt = 0
+    while True:
+        writer = None
+        try:
+            print('Connecting to PC server at {}:{}'.format(PC_IP, PC_PORT))
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(PC_IP, PC_PORT), 5)
+            print('Connected to PC server')
+            if C_PROTOCOL != 'lines':
+                # ask for the preferred protocol, falling back to frame
+                writer.write('hello:{}:{},frame\r\n'.format(C_PROTOCOL_VERSION, C_PROTOCOL).encode())
+                await writer.drain()
+            # a different server (or the same one restarted) may not send these
+            clear_server_metrics()
+            recv_len = 0
+            while True:
+                # nothing for C_LINK_TIMEOUT_MS, not even a heartbeat: the server or wifi has gone
+                n = await asyncio.wait_for(stream_readinto(reader, recv_mv[recv_len:]), C_LINK_TIMEOUT_MS / 1000)
+                if not n:
+                    raise OSError('Server closed connection')
+                link_status = None
+                attempt = 0
+                recv_len = drain_recv(recv_len + n)
+        except Exception as e:
+            print('Error receiving data:', repr(e))
+        if writer is not None:
+            print('Closing socket...')
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+        if link_status is None:
+            link_status = 'NO LINK'
+            link_since = time.ticks_ms()
+            # it was working a moment ago, likely a server restart, try again straight away
+            continue
+        delay = retry_delay(attempt, link_since)
+        attempt += 1
+        print('Failed to connect to PC server, retrying in {:.1f} seconds...'.format(delay))
+        await asyncio.sleep(delay)
+
+def link_text():
+    '''Bottom row text while the link is down, eg 'NO LINK 12s', None while it's up'''
+    if link_status is None:
+        return None
+    return '{} {}s'.format(link_status, time.ticks_diff(time.ticks_ms(), link_since) // 1000)
+
+async def render_task(renderer):
+    '''Draw each update as soon as net_task has parsed it, and the link status once a second while it's down'''
+    view = array('f', [0.0] * M_COUNT)
+    while True:
+        try:
+            await asyncio.wait_for(data_ready.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+        fresh = data_ready.is_set()
+        data_ready.clear()
+        renderer.draw_link(link_text())
+        if fresh:
+            with data_lock:
+                for i in range(M_COUNT):
+                    view[i] = latest[i]
+            renderer.draw(view)
+        renderer.display.show()
+        # cap the screen rate, anything arriving meanwhile is drawn straight after
+        await asyncio.sleep(C_FRAME_TIME)
+
+async def async_main(display):
+    '''The asyncio client: drawing starts straight away, then wifi, then the pc server'''
+    global data_ready, link_status, link_since
+    data_ready = asyncio.Event()
+    link_since = time.ticks_ms()
+    render = asyncio.create_task(render_task(Renderer(display)))
+    await connect_wifi_async()
+    link_status = 'NO LINK'
+    await net_task()
+
+def draw_bar_graph(fbuf, value, x=0, y=0,box_width=127, box_height=20, show_scale=False, last_width=None):
     '''
     Draw a box with a bar graph representation of a value (0-99) filling left to right.
     Optionally display scale markers left-to-right.
@@ -363,6 +991,10 @@ def draw_bar_graph(fbuf, value, x=0, y=0,box_width=127, box_height=20, show_scal
         x: Top-left x coordinate
         y: Top-left y coordinate
         show_scale: Boolean indicating whether to show scale markers (default False)
+        last_width: bar width returned by the previous call for this bar. If given the box and
+            scale are taken as already drawn and only the change in the fill is drawn or erased.
+
+    Returns the bar width in pixels.
     '''
     # Box dimensions
     #box_width = 127
@@ -371,6 +1003,23 @@ def draw_bar_graph(fbuf, value, x=0, y=0,box_width=127, box_height=20, show_scal
     # clamping to constraints to prevent overflows
     if value > 99: value = 99
     if value < 0: value = 0
+
+    if last_width is not None:
+        bar_width = int((value / 99.0) * box_width)
+        if bar_width > last_width:
+            fbuf.fill_rect(x+last_width, y, bar_width-last_width, box_height-1, 0x05)
+        elif bar_width < last_width:
+            # erase inside the outline only, then put back the scale markers that got rubbed out
+            x0 = max(x+bar_width, x+1)
+            x1 = min(x+last_width, x+box_width-1)
+            if x1 > x0:
+                fbuf.fill_rect(x0, y+1, x1-x0, box_height-2, 0)
+                if show_scale:
+                    for i in range(0, 10):
+                        pos = x + int((i * box_width) / 10)
+                        if x0 <= pos < x1:
+                            fbuf.vline(pos, y+box_height-2, 2, 1)
+        return bar_width
     
     # Draw the box outline
     fbuf.rect(x, y, box_width, box_height, 1)  # White outline
@@ -388,33 +1037,14 @@ def draw_bar_graph(fbuf, value, x=0, y=0,box_width=127, box_height=20, show_scal
             pos = int((i * box_width) / 10)
             fbuf.vline(x+pos, y+box_height-2, 2, 1)  # White line
 
+    return bar_width
 
 
 
 def main():
-    # globals for the display framebuffer
-    global cpu_usage
-    global ram_usage
-    global ram_total
-    global disk_usage
-    global gpu_usage
-    global vram_usage
-    global vram_total
-
-    cpu_usage = 0.0
-    ram_usage = 0.0
-    ram_total = 0.0
-    disk_usage = 0.0
-    gpu_usage = 0.0
-    vram_usage = 0.0
-    vram_total = 0.0
-
     # Initialize sock here
     global sock
     sock = None
-    # simple locking for thread. machine doesn't support Lock
-    global lock
-    lock = False
     # Initialize display (for test loop)
     # Set up I2C and the pins we're using for it
     i2c=I2C(0,sda=Pin(C_SDA), scl=Pin(C_SCL), freq=C_FREQ)
@@ -428,7 +1058,12 @@ def main():
     # Run test loop
     test_loop(display)
 
-
+    if C_ASYNC and C_TRANSPORT != 'udp':
+        try:
+            asyncio.run(async_main(display))
+        except KeyboardInterrupt:
+            print('Stopping...')
+        return
 
     # Connect to WiFi
     connect_wifi()
@@ -455,7 +1090,10 @@ def main():
     debug_output('Display updater started')
         
     try:
-        get_data()
+        if C_TRANSPORT == 'udp':
+            get_data_udp()
+        else:
+            get_data()
     except KeyboardInterrupt:
         print('Stopping...')
         close_sock()
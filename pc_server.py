@@ -1,14 +1,32 @@
 # pc_server.py
 # this is the server part that runs on a linux pc and serves cpu or ram stats to the the pico w client.
-# it uses nvidia-smi because i have a 4070ti and on linux.
-# on windows i don't know what to use. for AMD cards try using gpu_info. But you'll need to change the commands.
+# gpu stats come from gpu_provider.py (nvml, a streaming nvidia-smi, or sysfs for AMD/Intel), copy that across too.
+# --record/--replay use recording.py.
+# on windows i don't know what to use.
 #
+import argparse
+import asyncio
+import json
+import ipaddress
+import multiprocessing
+import os
+import select
+import signal
 import socket
+import struct
+from multiprocessing import shared_memory
 import time
-import subprocess
 import threading
 import sys
+from collections import deque
+from array import array
 import psutil
+import gpu_provider
+import recording
+try:
+    import numpy  # optional, window stats for --sample-rate go through it when it's there
+except ImportError:
+    numpy = None
 
 #AUTO-V
 version = "v0.1-2025/12/14r16"
@@ -16,98 +34,957 @@ version = "v0.1-2025/12/14r16"
 
 
 
-def get_cpu_usage():
-    '''Get current CPU usage percentage'''
-    try:
-        return int(psutil.cpu_percent(interval=0.1))
-    except ImportError:
-        # no fallback
-        return 0
-
-def get_ram_usage():
+def get_ram_usage(ram=None):
     '''Get current RAM usage in gigabytes with 1 decimal point'''
-    try:
-        used_bytes = psutil.virtual_memory().used
-        used_gb = used_bytes / (1024.0 ** 3)
-        return round(used_gb, 1)
-    except ImportError:
-        # no fallback
-        return 0.0
-
-def get_disk_io():
-    disk_io_before = psutil.disk_io_counters()
-    time.sleep(0.25)
-    disk_io_after = psutil.disk_io_counters()
-    read_bytes = disk_io_after.read_bytes - disk_io_before.read_bytes
-    write_bytes = disk_io_after.write_bytes - disk_io_before.write_bytes
-    read_bytes = round(read_bytes) * 4
-    write_bytes = round(write_bytes) * 4 # Multiply by 4 to guesstimate per second rate
-    return int(read_bytes + write_bytes)
-
-def get_ram_total():
-    ram = psutil.virtual_memory()
+    used_bytes = (ram or psutil.virtual_memory()).used
+    used_gb = used_bytes / (1024.0 ** 3)
+    return round(used_gb, 1)
+
+class RateCounters:
+    '''
+    Turns psutil's running counters into per-second rates without sleeping.
+    Keeps the previous snapshot and a monotonic timestamp, every sample() is the exact
+    delta since the last call divided by the real elapsed time.
+    The first call has nothing to compare with and reports zeros.
+    '''
+    def __init__(self):
+        self.last_time = None
+        self.last_cpu = None
+        self.last_disk = None
+        self.last_disks = None
+        self.last_net = None
+
+    def cpu_busy(self, times):
+        '''Return (busy, total) cpu seconds, counted the same way psutil.cpu_percent does'''
+        total = sum(times)
+        # on linux guest time is already counted in user/nice
+        total -= getattr(times, 'guest', 0) + getattr(times, 'guest_nice', 0)
+        idle = times.idle + getattr(times, 'iowait', 0)
+        return total - idle, total
+
+    def rate(self, now, before, elapsed):
+        # counters can go backwards if a disk/nic disappears, treat that as no traffic
+        if before is None or elapsed <= 0 or now < before:
+            return 0
+        return int((now - before) / elapsed)
+
+    def sample(self):
+        '''Return a dict of cpu percent and byte/s rates for disk, each disk and network'''
+        now = time.monotonic()
+        cpu = self.cpu_busy(psutil.cpu_times())
+        disk = psutil.disk_io_counters()
+        disks = psutil.disk_io_counters(perdisk=True) or {}
+        net = psutil.net_io_counters()
+        elapsed = (now - self.last_time) if self.last_time is not None else 0
+
+        cpu_pc = 0
+        if self.last_cpu is not None:
+            d_total = cpu[1] - self.last_cpu[1]
+            if d_total > 0:
+                cpu_pc = int(max(0.0, min(100.0, (cpu[0] - self.last_cpu[0]) * 100 / d_total)))
+
+        disk_read = disk_write = 0
+        if disk is not None and self.last_disk is not None:
+            disk_read = self.rate(disk.read_bytes, self.last_disk.read_bytes, elapsed)
+            disk_write = self.rate(disk.write_bytes, self.last_disk.write_bytes, elapsed)
+
+        per_disk = {}
+        for name, counters in disks.items():
+            before = self.last_disks.get(name) if self.last_disks is not None else None
+            if before is None:
+                per_disk[name] = (0, 0)
+            else:
+                per_disk[name] = (self.rate(counters.read_bytes, before.read_bytes, elapsed),
+                                  self.rate(counters.write_bytes, before.write_bytes, elapsed))
+
+        net_rx = net_tx = 0
+        if net is not None and self.last_net is not None:
+            net_rx = self.rate(net.bytes_recv, self.last_net.bytes_recv, elapsed)
+            net_tx = self.rate(net.bytes_sent, self.last_net.bytes_sent, elapsed)
+
+        self.last_time = now
+        self.last_cpu = cpu
+        self.last_disk = disk
+        self.last_disks = disks
+        self.last_net = net
+
+        return {
+            'cpu': cpu_pc,
+            'disk': disk_read + disk_write,
+            'disk_read': disk_read,
+            'disk_write': disk_write,
+            'disks': per_disk,
+            'net_rx': net_rx,
+            'net_tx': net_tx,
+        }
+
+def get_ram_total(ram=None):
+    ram = ram or psutil.virtual_memory()
     ram_total = ram.total / (1024 ** 3)
     return round(ram_total, 1)
 
-def get_gpu_utilization():
-    gpu_utilization = subprocess.run(["nvidia-smi", "--query-gpu=utilization.gpu", "--format=csv,noheader"], capture_output=True)
-    gpu_utilization = gpu_utilization.stdout.decode("utf-8").strip().split(' ')
-    return gpu_utilization[0]
+# order the rotating one-metric-per-message protocol walks through
+MESSAGE_ORDER = ('cpu', 'ram', 'disk', 'gpu', 'vram')
+# frames and records for clients that said hello with version 2 or more also carry every gpu
+# separately ('gpus'), gpu and vram above are then the aggregate (mean utilization, summed memory).
+# version 3 also gets the window peaks ('peak') when --sample-rate is on.
+MAX_GPUS = 8
+
+# wire protocols:
+#  lines: one name:value line per tick, rotating through MESSAGE_ORDER (what older picos expect)
+#  frame: every metric each tick in one line, name:value parts separated by |
+#  bin:   every metric each tick in one fixed 24 byte struct record, see BIN_FORMAT
+# clients start on the server's --protocol and can ask for another by sending
+# hello:<version>:<protocols in preference order>, eg hello:2:bin,frame
+# the server answers hello:<version>:<chosen> and switches. old picos never send a hello.
+# version 2 clients also get per gpu parts/records when there's more than one gpu, version 3 peaks.
+PROTOCOLS = ('lines', 'frame', 'bin')
+PROTOCOL_VERSION = 3
+
+# binary record: magic 'LC', version, flags, seq, cpu %, gpu %, ram used and total in
+# tenths of GB, vram used and total in MiB, disk bytes/s. little endian, no padding.
+# flags is the relay host (see RELAY_SUMMARY), 0 when not relaying.
+BIN_MAGIC = b'LC'
+BIN_VERSION = 1
+BIN_FORMAT = '<2sBBHBBHHIII'
+BIN_SIZE = struct.calcsize(BIN_FORMAT)
+# per gpu record, one per card straight after the LC record (just the one with index 0 for the
+# count on a box with fewer than two): magic 'LG', version, index, gpu count, utilization %,
+# reserved, vram used and total in MiB. 16 bytes.
+GPU_MAGIC = b'LG'
+GPU_FORMAT = '<2sBBBBHII'
+GPU_SIZE = struct.calcsize(GPU_FORMAT)
+# window peaks record, after the LC (and LG) records: magic 'LP', version, cpu max %, gpu max %,
+# reserved, disk max bytes/s. 10 bytes.
+PEAK_MAGIC = b'LP'
+PEAK_FORMAT = '<2sBBBBI'
+PEAK_SIZE = struct.calcsize(PEAK_FORMAT)
+
+# delta mode (--delta, frame and bin only): a metric is only sent once it has moved more than
+# its threshold (Metric.threshold, DELTA_THRESHOLDS below) from the value last sent to that client.
+# a full frame/record still goes out every heartbeat so the pico can tell the link is alive.
+HEARTBEAT = 5.0
+
+# a client gets the latest snapshot in full as soon as it connects, after this long to say hello
+# so it goes out in the protocol it wants. old picos say nothing and only wait this long.
+HELLO_WAIT = 0.05
+
+# --timestamps: frames also carry ts (when the snapshot was sampled) and tx (when it was encoded
+# for sending), both wall clock microseconds. for latency benchmarks, the pico skips them.
+TIMESTAMPS = False
+
+class Timing:
+    '''
+    Durations of one thing, the last `keep` of them for percentiles plus running count/total/max.
+    add() is a deque append, so it costs next to nothing on the hot path.
+    '''
+    def __init__(self, keep=1024):
+        self.recent = deque(maxlen=keep)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.recent.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def percentile(self, pc):
+        recent = sorted(self.recent)
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(len(recent) * pc / 100))]
+
+    def row(self, name):
+        '''One report line, all in milliseconds'''
+        mean = self.total / self.count if self.count else 0.0
+        return '  {:<22} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+            name, self.count, mean * 1000, self.percentile(50) * 1000, self.percentile(99) * 1000, self.max * 1000)
+
+class ClientStats:
+    '''Send counters and lag for one client, only ever updated by the thread/task serving it'''
+    def __init__(self, address, protocol):
+        self.address = address
+        self.protocol = protocol
+        self.messages = 0
+        self.bytes = 0
+        self.skipped = 0      # ticks where delta mode had nothing to send
+        self.missed = 0       # collector ticks this client never saw (it was too slow)
+        self.buffer = 0       # asyncio only, bytes queued but not yet sent
+        self.buffer_max = 0
+        self.lag = Timing()   # snapshot sampled -> handed to the socket
+        self.send = Timing()  # how long the send call itself took
+
+    def sent(self, data, snapshot, started):
+        now = time.time()
+        if data is None:
+            self.skipped += 1
+            return
+        self.messages += 1
+        self.bytes += len(data)
+        self.send.add(now - started)
+        if 'time' in snapshot: self.lag.add(now - snapshot['time'])
+
+class Stats:
+    '''
+    Everything --stats collects, for the stats port and the SIGUSR1 dump.
+    With --stats off STATS is None and nothing is recorded.
+    '''
+    def __init__(self):
+        self.started = time.monotonic()
+        # reentrant: the SIGUSR1 dump runs report() in the main thread, which may be holding
+        # it already (asyncio mode counts and connects clients there)
+        self.lock = threading.RLock()
+        self.timings = {}
+        self.counters = {'connected': 0, 'disconnected': 0, 'dropped': 0, 'overruns': 0}
+        self.clients = {}
+
+    def timing(self, name):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings.setdefault(name, Timing())
+        return timing
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def connect(self, key, address, protocol):
+        client = ClientStats(address, protocol)
+        with self.lock:
+            self.clients[key] = client
+            self.counters['connected'] += 1
+        return client
+
+    def disconnect(self, key):
+        with self.lock:
+            if self.clients.pop(key, None) is not None:
+                self.counters['disconnected'] += 1
+
+    def report(self):
+        with self.lock:
+            timings = sorted(self.timings.items())
+            counters = dict(self.counters)
+            clients = list(self.clients.values())
+        lines = ['pc_server {} stats, pid {}, up {:.0f}s'.format(version, os.getpid(), time.monotonic() - self.started)]
+        if timings:
+            lines.append('  {:<22} {:>8} {:>9} {:>9} {:>9} {:>9}'.format('timing (ms)', 'count', 'mean', 'p50', 'p99', 'max'))
+            lines.extend(timing.row(name) for name, timing in timings)
+        lines.append('  ' + ', '.join('{} {}'.format(name, value) for name, value in counters.items()))
+        lines.append('  {} clients'.format(len(clients)))
+        for client in clients:
+            lines.append('  {} {}: {} messages, {} bytes, {} skipped, {} missed ticks, buffer {} (max {}), '
+                         'lag p50/p99 {:.1f}/{:.1f}ms, send p99 {:.3f}ms'.format(
+                             client.address, client.protocol, client.messages, client.bytes, client.skipped, client.missed,
+                             client.buffer, client.buffer_max, client.lag.percentile(50) * 1000,
+                             client.lag.percentile(99) * 1000, client.send.percentile(99) * 1000))
+        return '\n'.join(lines) + '\n'
+
+# --stats: a Stats, else None
+STATS = None
+
+class Metric:
+    '''
+    One value in the snapshot, the collector runs whatever is due each tick.
+    read(reads) returns the value, getting psutil/gpu data through reads.get() so a call shared
+    by several metrics is only made once a tick.
+    interval: seconds between samples, 0 is every tick. between samples the last value is served,
+    so slow ones are cached (totals only need reading now and then).
+    ttl: how long the last good value is kept while read() keeps failing, then it's back to default.
+    threshold: for --delta, how far it moves before it is sent again, units as in the snapshot.
+    window: with --sample-rate it's sampled at that rate, and the snapshot gets the mean over the
+    window as key plus key_min, key_max and key_p95. integers only.
+    '''
+    def __init__(self, key, read, interval=0.0, ttl=10.0, default=0, threshold=0, window=False):
+        self.key = key
+        self.read = read
+        self.interval = interval
+        self.ttl = ttl
+        self.default = default
+        self.threshold = threshold
+        self.window = window
+
+class Reads:
+    '''The calls behind the metrics for one tick, each made at most once, failures included'''
+    def __init__(self, collector):
+        self.collector = collector
+        self.done = {}
+
+    def get(self, name):
+        if name not in self.done:
+            start = time.perf_counter()
+            try:
+                self.done[name] = getattr(self.collector, 'read_' + name)()
+            except Exception as e:
+                self.done[name] = e
+            if STATS is not None:
+                STATS.timing('collect ' + name).add(time.perf_counter() - start)
+        result = self.done[name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+def gpu_util(reads):
+    # aggregate over every card, exactly the first card's value on a single gpu box
+    gpus = reads.get('gpus')
+    return round(sum(g.util for g in gpus) / len(gpus)) if gpus else 0
+
+# everything the collector samples. to add one: a Metric here (plus a read_ method on Collector
+# if it needs a new call), and a Message below if it goes on the wire.
+METRICS = (
+    # cpu, disk and network are counter deltas since the last tick, nothing here sleeps
+    Metric('cpu', lambda reads: reads.get('rates')['cpu'], threshold=2, window=True),
+    Metric('disk', lambda reads: reads.get('rates')['disk'], threshold=64 * 1024, window=True),
+    Metric('disk_read', lambda reads: reads.get('rates')['disk_read'], window=True),
+    Metric('disk_write', lambda reads: reads.get('rates')['disk_write'], window=True),
+    Metric('disks', lambda reads: reads.get('rates')['disks'], default={}),
+    Metric('net_rx', lambda reads: reads.get('rates')['net_rx'], window=True),
+    Metric('net_tx', lambda reads: reads.get('rates')['net_tx'], window=True),
+    Metric('ram', lambda reads: get_ram_usage(reads.get('memory')), threshold=0.1),
+    Metric('ram_total', lambda reads: get_ram_total(reads.get('memory')), interval=60.0, ttl=600.0),
+    Metric('gpu', gpu_util, threshold=2, window=True),
+    Metric('vram', lambda reads: sum(g.mem_used for g in reads.get('gpus')), threshold=64),
+    Metric('vram_total', lambda reads: sum(g.mem_total for g in reads.get('gpus')), interval=30.0, ttl=600.0),
+    # [util, used, total] per card, lists so the snapshot still goes through json
+    Metric('gpus', lambda reads: [[g.util, g.mem_used, g.mem_total] for g in reads.get('gpus')], default=[]),
+)
+DELTA_THRESHOLDS = {metric.key: metric.threshold for metric in METRICS}
+
+class Windows:
+    '''
+    The last `size` fast samples of each windowed metric in fixed rings, for --sample-rate.
+    With numpy the rings are one 2d array and stats() is a handful of calls over all of them,
+    without it it's plain python per metric. Same numbers either way (p95 interpolates like numpy).
+    '''
+    def __init__(self, keys, size):
+        self.keys = keys
+        self.size = size
+        self.pos = 0
+        self.filled = 0
+        if numpy is not None:
+            self.rings = numpy.zeros((len(keys), size))
+        else:
+            self.rings = [array('d', [0.0] * size) for key in keys]
+
+    def add(self, snapshot):
+        for i, key in enumerate(self.keys):
+            self.rings[i][self.pos] = snapshot[key]
+        self.pos = (self.pos + 1) % self.size
+        if self.filled < self.size: self.filled += 1
+
+    def stats(self):
+        '''Return {key: mean, key_min, key_max, key_p95} over the window for every key, rounded'''
+        if not self.filled:
+            return {}
+        if numpy is not None:
+            # order in the ring doesn't matter for any of these
+            window = self.rings[:, :self.filled]
+            rows = zip(window.mean(axis=1), window.min(axis=1), window.max(axis=1), numpy.percentile(window, 95, axis=1))
+        else:
+            rows = []
+            for ring in self.rings:
+                values = sorted(ring[:self.filled])
+                rank = (len(values) - 1) * 0.95
+                low = int(rank)
+                high = min(low + 1, len(values) - 1)
+                p95 = values[low] + (values[high] - values[low]) * (rank - low)
+                rows.append((sum(values) / len(values), values[0], values[-1], p95))
+        stats = {}
+        for key, (mean, low, high, p95) in zip(self.keys, rows):
+            stats[key] = int(round(mean))
+            stats[key + '_min'] = int(round(low))
+            stats[key + '_max'] = int(round(high))
+            stats[key + '_p95'] = int(round(p95))
+        return stats
+
+class Collector(threading.Thread):
+    '''
+    Samples every metric in METRICS that is due each tick into a shared snapshot.
+    Client handlers only read the snapshot, so N displays cost one lot of sampling.
+    With sample_tick the metrics are sampled that often and the windowed ones go through
+    Windows, the snapshot still only goes out every tick.
+    '''
+    def __init__(self, gpu=None, tick=0.25, metrics=METRICS, sample_tick=None, window=1.0):
+        super().__init__(daemon=True)
+        self.gpu = gpu if gpu is not None else gpu_provider.GpuProvider()
+        self.rates = RateCounters()
+        self.tick = tick
+        self.sample_tick = sample_tick or tick
+        self.windows = None
+        if sample_tick:
+            self.windows = Windows([metric.key for metric in metrics if metric.window],
+                                   max(1, int(round(window / sample_tick))))
+        self.metrics = metrics
+        self.values = {metric.key: metric.default for metric in metrics}
+        self.next_due = {}
+        self.last_good = {}
+        self.errors = {}
+        self.seq = 0
+        self.snapshot = {}
+        self.cond = threading.Condition()
+
+    def read_rates(self):
+        return self.rates.sample()
+
+    def read_memory(self):
+        return psutil.virtual_memory()
+
+    def read_gpus(self):
+        # every field of every gpu comes from the one provider read
+        return self.gpu.read()[:MAX_GPUS]
+
+    def sample(self):
+        '''Sample every metric that is due, returns a snapshot of all of them'''
+        sampled = time.time()
+        now = time.monotonic()
+        start = time.perf_counter()
+        reads = Reads(self)
+        for metric in self.metrics:
+            if now < self.next_due.get(metric.key, 0):
+                continue
+            self.next_due[metric.key] = now + metric.interval
+            try:
+                self.values[metric.key] = metric.read(reads)
+                self.last_good[metric.key] = now
+                self.errors.pop(metric.key, None)
+            except Exception as e:
+                if self.errors.get(metric.key) != str(e):
+                    # once per new error, not every tick
+                    print('Collector error in {}: {}'.format(metric.key, e))
+                    self.errors[metric.key] = str(e)
+                if now - self.last_good.get(metric.key, now - metric.ttl - 1) > metric.ttl:
+                    self.values[metric.key] = metric.default
+        if STATS is not None:
+            STATS.timing('collect total').add(time.perf_counter() - start)
+        snapshot = dict(self.values)
+        snapshot['time'] = sampled
+        return snapshot
+
+    def run(self):
+        next_publish = time.monotonic()
+        while True:
+            start = time.monotonic()
+            try:
+                snapshot = self.sample()
+            except Exception as e:
+                print('Collector error:', e)
+                snapshot = None
+
+            if snapshot is not None and self.windows is not None:
+                self.windows.add(snapshot)
+            if snapshot is not None and start >= next_publish:
+                if self.windows is not None:
+                    snapshot.update(self.windows.stats())
+                with self.cond:
+                    self.snapshot = snapshot
+                    self.seq += 1
+                    self.cond.notify_all()
+                next_publish += self.tick
+                if next_publish < start:
+                    # fell behind, don't try to catch up
+                    next_publish = start + self.tick
+
+            delay = self.sample_tick - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            elif STATS is not None:
+                STATS.count('overruns')
+
+    def wait_snapshot(self, last_seq, timeout=None):
+        '''Block until a snapshot newer than last_seq is published, returns (seq, snapshot)'''
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq, self.snapshot
+
+class Message:
+    '''
+    A name:value[/value] part on the wire, made from snapshot keys. text(snapshot) replaces the
+    default formatting, for parts that aren't one name with its values. With a default the
+    keys can be missing from the snapshot, default is sent instead.
+    '''
+    def __init__(self, name, keys, text=None, default=None):
+        self.name = name
+        self.keys = keys
+        self.text = text
+        self.default = default
+
+    def values(self, snapshot):
+        if self.default is None:
+            return [snapshot[key] for key in self.keys]
+        return [snapshot.get(key, self.default) for key in self.keys]
+
+    def encode(self, snapshot):
+        if self.text is not None:
+            return self.text(snapshot)
+        return self.name + ':' + '/'.join(str(value) for value in self.values(snapshot))
+
+def gpus_text(snapshot):
+    # gn:<count> then g<index>:util/used/total for each card. only gn:0 or gn:1 on a box with
+    # fewer than two, the totals are that card, but the count has to go so a client stops paging
+    gpus = snapshot.get('gpus', ())
+    if len(gpus) < 2:
+        return 'gn:{}'.format(len(gpus))
+    return 'gn:{}|'.format(len(gpus)) + '|'.join('g{}:{}/{}/{}'.format(i, *gpu) for i, gpu in enumerate(gpus))
+
+# what can go on the wire, MESSAGE_ORDER and tick_payload pick which and in what order.
+# host only says anything on a relay, it goes with every frame
+MESSAGES = {message.name: message for message in (
+    Message('cpu', ('cpu',)),
+    Message('ram', ('ram', 'ram_total')),
+    Message('disk', ('disk',)),
+    Message('gpu', ('gpu',)),
+    Message('vram', ('vram', 'vram_total')),
+    Message('gpus', ('gpus',), gpus_text, default=[]),
+    Message('host', ('host',), lambda snapshot: 'host:{}'.format(snapshot['host']) if 'host' in snapshot else ''),
+    # highest in the last window, zeros without --sample-rate so a client drops any it had
+    Message('peak', ('cpu_max', 'gpu_max', 'disk_max'), default=0),
+)}
+
+def format_message(snapshot, name):
+    '''Build a single name:value message from a snapshot'''
+    return MESSAGES[name].encode(snapshot)
+
+def format_frame(snapshot, names=MESSAGE_ORDER):
+    '''
+    Build a snapshot frame, eg cpu:12|ram:5.1/31.3|disk:0|gpu:3|vram:1200/12282. On a relay host
+    goes first, the pico clears what it had from the last machine when host changes.
+    '''
+    return '|'.join(filter(None, (format_message(snapshot, name) for name in ('host',) + names)))
+
+def parse_number(text):
+    return float(text) if '.' in text else int(text)
+
+def parse_frame(line, snapshot):
+    '''
+    Apply a frame or single message from another pc_server to a snapshot dict, the reverse of
+    format_frame. Unknown parts are skipped, so a peer can be newer or older than us.
+    '''
+    for part in line.split('|'):
+        name, _, value = part.partition(':')
+        message = MESSAGES.get(name)
+        try:
+            if message is not None and message.text is None:
+                for key, field in zip(message.keys, value.split('/')):
+                    snapshot[key] = parse_number(field)
+            elif name == 'gn':
+                gpus = list(snapshot.get('gpus', ()))[:int(value)]
+                snapshot['gpus'] = gpus + [[0, 0, 0] for i in range(int(value) - len(gpus))]
+            elif name[:1] == 'g' and name[1:].isdigit():
+                index = int(name[1:])
+                if index < len(snapshot.get('gpus', ())):
+                    snapshot['gpus'][index] = [parse_number(field) for field in value.split('/')][:3]
+        except ValueError:
+            pass
+    gpus = snapshot.get('gpus')
+    if gpus is not None and len(gpus) == 1:
+        # gn:1 comes without a g0 (see gpus_text), the one card is the totals. they're kept in step
+        # here, with --delta the peer sends gpu/vram when they move but gn only when the count does
+        gpus[0] = [snapshot.get('gpu', 0), snapshot.get('vram', 0), snapshot.get('vram_total', 0)]
+
+def clamp(value, top):
+    return max(0, min(int(value), top))
+
+def pack_record(snapshot, seq):
+    '''Pack a snapshot into a binary record'''
+    return struct.pack(BIN_FORMAT, BIN_MAGIC, BIN_VERSION, clamp(snapshot.get('host', 0), 0xFF), seq & 0xFFFF,
+                       clamp(snapshot['cpu'], 100), clamp(snapshot['gpu'], 100),
+                       clamp(float(snapshot['ram']) * 10, 0xFFFF), clamp(float(snapshot['ram_total']) * 10, 0xFFFF),
+                       clamp(snapshot['vram'], 0xFFFFFFFF), clamp(snapshot['vram_total'], 0xFFFFFFFF),
+                       clamp(snapshot['disk'], 0xFFFFFFFF))
+
+def pack_gpu_records(snapshot):
+    '''One LG record per gpu. With fewer than two just one, for the count (0 or 1)'''
+    gpus = snapshot.get('gpus', ())
+    if len(gpus) < 2:
+        util, used, total = gpus[0] if gpus else (0, 0, 0)
+        return struct.pack(GPU_FORMAT, GPU_MAGIC, BIN_VERSION, 0, len(gpus), clamp(util, 100), 0,
+                           clamp(used, 0xFFFFFFFF), clamp(total, 0xFFFFFFFF))
+    return b''.join(struct.pack(GPU_FORMAT, GPU_MAGIC, BIN_VERSION, i, len(gpus), clamp(util, 100), 0,
+                                clamp(used, 0xFFFFFFFF), clamp(total, 0xFFFFFFFF))
+                    for i, (util, used, total) in enumerate(gpus))
+
+def pack_peak_record(snapshot):
+    '''The window peaks as an LP record, zeros without --sample-rate'''
+    return struct.pack(PEAK_FORMAT, PEAK_MAGIC, BIN_VERSION, clamp(snapshot.get('cpu_max', 0), 100),
+                       clamp(snapshot.get('gpu_max', 0), 100), 0, clamp(snapshot.get('disk_max', 0), 0xFFFFFFFF))
+
+class TickEncoder:
+    '''Encodes one snapshot per protocol on demand, once per tick however many clients want it'''
+    def __init__(self, seq, snapshot):
+        self.seq = seq
+        self.snapshot = snapshot
+        self.cache = {}
+
+    def encode(self, protocol, toggle_counter=0, names=MESSAGE_ORDER):
+        if protocol == 'lines':
+            key = (protocol, toggle_counter)
+        elif protocol == 'frame':
+            key = (protocol, names)
+        else:
+            key = (protocol, 'gpus' in names, 'peak' in names)
+        data = self.cache.get(key)
+        if data is None:
+            match protocol:
+                case 'bin':
+                    data = pack_record(self.snapshot, self.seq)
+                    if 'gpus' in names:
+                        data += pack_gpu_records(self.snapshot)
+                    if 'peak' in names:
+                        data += pack_peak_record(self.snapshot)
+                case 'frame':
+                    text = format_frame(self.snapshot, names)
+                    if TIMESTAMPS:
+                        text += '|ts:{}|tx:{}'.format(int(self.snapshot['time'] * 1000000), int(time.time() * 1000000))
+                    data = '{}\r\n'.format(text).encode()
+                case _: data = '{}\r\n'.format(format_message(self.snapshot, MESSAGE_ORDER[toggle_counter])).encode()
+            self.cache[key] = data
+        return data
+
+class DeltaFilter:
+    '''Per client record of what was last sent, for --delta'''
+    def __init__(self, heartbeat=HEARTBEAT):
+        self.heartbeat = heartbeat
+        self.sent = {}
+        self.last_send = None
+
+    def changed(self, snapshot, now, order=MESSAGE_ORDER):
+        '''Return the names in order that need sending, all of them when a heartbeat is due'''
+        if self.last_send is None or now - self.last_send >= self.heartbeat:
+            return order
+        if snapshot.get('host', 0) != self.sent.get('host', 0):
+            # relay moved on to another machine, everything is different
+            return order
+        names = []
+        for name in order:
+            message = MESSAGES[name]
+            for key, value in zip(message.keys, message.values(snapshot)):
+                if key not in self.sent or self.moved(key, value, self.sent[key]):
+                    names.append(name)
+                    break
+        return tuple(names)
+
+    def moved(self, key, value, sent):
+        if key == 'gpus':
+            # per card, same thresholds as the aggregate
+            return len(value) != len(sent) or any(
+                abs(util - s_util) > DELTA_THRESHOLDS['gpu'] or abs(used - s_used) > DELTA_THRESHOLDS['vram']
+                for (util, used, _), (s_util, s_used, _) in zip(value, sent))
+        if key not in DELTA_THRESHOLDS:
+            # cpu_max and friends go by the metric's own threshold
+            key = key.rsplit('_', 1)[0]
+        return abs(value - sent) > DELTA_THRESHOLDS[key]
+
+    def mark(self, snapshot, names, now):
+        for name in names:
+            message = MESSAGES[name]
+            for key, value in zip(message.keys, message.values(snapshot)):
+                self.sent[key] = value
+        self.sent['host'] = snapshot.get('host', 0)
+        self.last_send = now
 
-def get_gpu_memory():
-    gpu_memory = subprocess.run(["nvidia-smi", "--query-gpu=memory.used", "--format=csv,noheader"], capture_output=True)
-    gpu_memory = gpu_memory.stdout.decode("utf-8").strip().split(' ')
-    return gpu_memory[0]
+def tick_payload(encoder, protocol, toggle_counter, delta, version=1):
+    '''
+    Work out what one client gets this tick, None means nothing to send.
+    version is the client's hello version, it decides whether per gpu values and peaks go too.
+    '''
+    if protocol == 'lines':
+        # old picos can only take one message per recv, they stay fixed rate
+        return encoder.encode(protocol, toggle_counter)
+    order = MESSAGE_ORDER
+    if version >= 2:
+        # the count even with one gpu, a client paging through cards has to know there's one now
+        order += ('gpus',)
+    if version >= 3:
+        # always, zeros when there are none, otherwise a client keeps showing the last ones
+        order += ('peak',)
+    if delta is None:
+        return encoder.encode(protocol, names=order)
+    now = time.monotonic()
+    names = delta.changed(encoder.snapshot, now, order)
+    if not names:
+        return None
+    if protocol == 'bin':
+        # a record always carries everything
+        names = order
+    delta.mark(encoder.snapshot, names, now)
+    return encoder.encode(protocol, names=names)
 
-def get_gpu_total_memory():
-    gpu_memory = subprocess.run(["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader"], capture_output=True)
-    gpu_memory = gpu_memory.stdout.decode("utf-8").strip().split(' ')
-    return gpu_memory[0]
+def full_payload(encoder, protocol, delta, version=1):
+    '''
+    The whole snapshot for a client that just connected or switched protocol, so its display
+    isn't zeros until the next ticks fill it in. None for lines: old picos take one message per
+    recv and throw away lines that arrive together, so they only get their message a tick.
+    '''
+    if protocol == 'lines':
+        return None
+    if delta is not None:
+        # same as a heartbeat, everything goes and the filter knows it did
+        delta.last_send = None
+    return tick_payload(encoder, protocol, 0, delta, version)
 
-def handle_client(client_socket, address):
-    '''Handle a connected client'''
+def parse_hello(line):
+    '''
+    Handle a hello:<version>:<protocols> line from a client, protocols in order of preference.
+    Returns (protocol to switch to, client's version), or None if it isn't a hello we can use.
+    '''
+    try:
+        fields = line.decode().strip().split(':')
+    except UnicodeError:
+        return None
+    if len(fields) != 3 or fields[0] != 'hello':
+        return None
+    try:
+        version = int(fields[1])
+    except ValueError:
+        return None
+    for protocol in fields[2].split(','):
+        if protocol in PROTOCOLS:
+            return protocol, version
+    return None
+
+def hello_reply(protocol):
+    return 'hello:{}:{}\r\n'.format(PROTOCOL_VERSION, protocol).encode()
+
+def handle_client(client_socket, address, collector, protocol='lines', delta=False):
+    '''Handle a connected client, one message, frame or record per collector tick'''
     print('Client connected from:', address)
+    delta_filter = DeltaFilter() if delta else None
+    client_stats = STATS.connect(client_socket, address, protocol) if STATS is not None else None
     try:
-        send_data=''
-        toggle_counter = 0  # local counter: 4 * 0.25s = 1s
+        send_data=b''
+        toggle_counter = 0
+        seq = 0
+        received = b''
+        client_version = 1
+        full = True
         while True:
-            match toggle_counter:
-                case 0: send_data = 'cpu:'+str(get_cpu_usage())
-                case 1: send_data = 'ram:'+str(get_ram_usage())+'/'+str(get_ram_total())
-                case 2: send_data = 'disk:'+str(get_disk_io())
-                case 3: send_data = 'gpu:'+str(get_gpu_utilization())
-                case 4: send_data = 'vram:'+str(get_gpu_memory()+'/'+str(get_gpu_total_memory()))
-                
+            # wait for the next tick, the collector does all the sampling
+            last_seq = seq
+            seq, snapshot = collector.wait_snapshot(seq)
+            if client_stats is not None and last_seq and seq - last_seq > 1:
+                # the shared memory sequence goes up by 2 a snapshot, the collector's by 1
+                client_stats.missed += (seq - last_seq) // (2 if isinstance(collector, SharedSnapshotReader) else 1) - 1
+
+            # pick up a hello (or a disconnect) without blocking, a new client gets HELLO_WAIT
+            readable, _, _ = select.select([client_socket], [], [], HELLO_WAIT if full else 0)
+            if readable:
+                data = client_socket.recv(256)
+                if not data:
+                    break
+                received += data
+                while b'\n' in received:
+                    line, received = received.split(b'\n', 1)
+                    chosen = parse_hello(line)
+                    if chosen is not None:
+                        protocol, version = chosen
+                        client_version = version
+                        if delta_filter is not None:
+                            # whatever went out before the switch may not have been understood
+                            delta_filter = DeltaFilter()
+                        client_socket.sendall(hello_reply(protocol))
+                        full = True
+                        print('Client', address, 'switched to', protocol)
+                        if client_stats is not None: client_stats.protocol = protocol
+                received = received[-256:]
+
+            started = time.time()
+            encoder = TickEncoder(seq, snapshot)
+            send_data = None
+            if full:
+                # first tick or a new protocol, everything now rather than over the next ticks
+                send_data = full_payload(encoder, protocol, delta_filter, client_version)
+                full = False
+            if send_data is None:
+                send_data = tick_payload(encoder, protocol, toggle_counter, delta_filter, client_version)
+
             # Send to rpi
-            print('Sending data:', send_data)
-            client_socket.send('{}\r\n'.format(send_data).encode())
-            
-            # Wait before next update, unless disk because that already does it.
-            if toggle_counter != 2: time.sleep(0.25)
+            if send_data is not None:
+                client_socket.sendall(send_data)
+            if client_stats is not None:
+                client_stats.sent(send_data, snapshot, started)
 
             toggle_counter += 1
-            if toggle_counter == 5: toggle_counter = 0
+            if toggle_counter == len(MESSAGE_ORDER): toggle_counter = 0
             
     except Exception as e:
         print('Client error:', e)
     finally:
         client_socket.close()
+        if STATS is not None: STATS.disconnect(client_socket)
         print('Client disconnected:', address)
 
-def main():
-    # Server configuration
-    HOST = '192.168.1.201'  # Listen on all interfaces
-    PORT = 9002
-    
+class AsyncClient:
+    '''Per connection state for the asyncio server'''
+    __slots__ = ('writer', 'address', 'protocol', 'toggle_counter', 'delta', 'version', 'stats', 'greeting')
+
+    def __init__(self, writer, address, protocol, delta):
+        self.writer = writer
+        self.address = address
+        self.protocol = protocol
+        self.toggle_counter = 0
+        self.version = 1
+        self.delta = DeltaFilter() if delta else None
+        self.stats = STATS.connect(writer, address, protocol) if STATS is not None else None
+        # AsyncServer.send_full task
+        self.greeting = None
+
+class AsyncServer:
+    '''
+    asyncio streams server, same wire protocol as handle_client.
+    One broadcast task sends each collector tick to every client, messages are encoded once
+    per tick not once per client. Nothing waits on a slow client: if its unsent data grows
+    past max_buffer it is dropped, so memory stays bounded however many displays connect.
+    '''
+    def __init__(self, collector, protocol='lines', delta=False, max_buffer=16 * 1024):
+        self.collector = collector
+        self.protocol = protocol
+        self.delta = delta
+        self.max_buffer = max_buffer
+        self.clients = {}
+        # (seq, snapshot) of the last tick, for send_full
+        self.latest = None
+        # client handler tasks, stop() lets them finish rather than asyncio.run cancelling them
+        self.handlers = set()
+
+    async def handle(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        print('Client connected from:', address)
+        client = AsyncClient(writer, address, self.protocol, self.delta)
+        self.clients[writer] = client
+        self.handlers.add(asyncio.current_task())
+        client.greeting = asyncio.create_task(self.send_full(client, HELLO_WAIT))
+        try:
+            # the only thing clients send is a hello, reading also tells us when they go away
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                chosen = parse_hello(line)
+                if chosen is not None:
+                    protocol, version = chosen
+                    client.protocol = protocol
+                    client.version = version
+                    if client.delta is not None:
+                        # whatever went out before the switch may not have been understood
+                        client.delta = DeltaFilter()
+                    if client.stats is not None: client.stats.protocol = protocol
+                    writer.write(hello_reply(protocol))
+                    # the snapshot again in the new protocol, straight away
+                    client.greeting.cancel()
+                    client.greeting = asyncio.create_task(self.send_full(client))
+        except (ConnectionError, OSError, ValueError):
+            # ValueError is a line longer than the stream limit, nothing a pico would send
+            pass
+        finally:
+            self.drop(writer)
+            self.handlers.discard(asyncio.current_task())
+
+    def drop(self, writer):
+        client = self.clients.pop(writer, None)
+        if client is not None:
+            client.greeting.cancel()
+            writer.close()
+            if client.stats is not None: STATS.disconnect(writer)
+            print('Client disconnected:', client.address)
+
+    async def send_full(self, client, wait=0):
+        '''
+        The latest snapshot in full for a client that just connected (after wait, for its hello)
+        or switched protocol. Before the first tick there's nothing, the broadcast gets there.
+        '''
+        await asyncio.sleep(wait)
+        if self.latest is None:
+            return
+        seq, snapshot = self.latest
+        started = time.time()
+        data = full_payload(TickEncoder(seq, snapshot), client.protocol, client.delta, client.version)
+        if data is None or client.writer.is_closing():
+            return
+        client.writer.write(data)
+        if client.stats is not None:
+            client.stats.sent(data, snapshot, started)
+
+    def send_tick(self, seq, snapshot):
+        '''Send one tick to every client'''
+        encoder = TickEncoder(seq, snapshot)
+        tick_start = time.perf_counter()
+        for writer, client in list(self.clients.items()):
+            buffered = 0 if writer.is_closing() else writer.transport.get_write_buffer_size()
+            if writer.is_closing() or buffered > self.max_buffer:
+                # stalled or gone, don't let it queue up forever
+                if STATS is not None and not writer.is_closing(): STATS.count('dropped')
+                self.drop(writer)
+                continue
+            started = time.time()
+            data = tick_payload(encoder, client.protocol, client.toggle_counter, client.delta, client.version)
+            if data is not None:
+                writer.write(data)
+            if client.stats is not None:
+                client.stats.buffer = buffered
+                if buffered > client.stats.buffer_max: client.stats.buffer_max = buffered
+                client.stats.sent(data, snapshot, started)
+            client.toggle_counter += 1
+            if client.toggle_counter == len(MESSAGE_ORDER): client.toggle_counter = 0
+        if STATS is not None:
+            STATS.timing('asyncio send tick').add(time.perf_counter() - tick_start)
+
+    async def broadcast(self):
+        loop = asyncio.get_running_loop()
+        seq = 0
+        while True:
+            # the collector is a thread, wait for its tick without blocking the loop
+            new_seq, snapshot = await loop.run_in_executor(None, self.collector.wait_snapshot, seq, 1.0)
+            if STATS is not None and new_seq != seq:
+                # how far behind the collector the loop picked the tick up
+                STATS.timing('asyncio tick wakeup').add(max(0.0, time.time() - snapshot.get('time', time.time())))
+            if new_seq != seq:
+                seq = new_seq
+                self.latest = (seq, snapshot)
+                self.send_tick(seq, snapshot)
+
+    async def serve(self, host, port, backlog, reuse_port=False):
+        server = await asyncio.start_server(self.handle, host, port, backlog=backlog,
+                                            reuse_address=True, reuse_port=reuse_port or None, limit=1024)
+        print('Server (asyncio) listening on {}:{}'.format(host, port))
+        print('Waiting for connections...')
+        tasks = asyncio.gather(server.serve_forever(), self.broadcast())
+        loop = asyncio.get_running_loop()
+        for name in ('SIGTERM', 'SIGHUP', 'SIGINT'):
+            if hasattr(signal, name):
+                # not stop_server (or KeyboardInterrupt), an exception from inside the loop is a
+                # traceback for every client callback
+                loop.add_signal_handler(getattr(signal, name), self.stop, server, tasks)
+        async with server:
+            try:
+                await tasks
+            except asyncio.CancelledError:
+                print('\nServer stopping...')
+                # the clients were hung up on, their handlers only have to see it
+                if self.handlers:
+                    await asyncio.wait(self.handlers, timeout=1.0)
+
+    def stop(self, server, tasks):
+        '''SIGTERM/SIGHUP/SIGINT in asyncio mode: stop accepting, hang up on everyone and let serve() return'''
+        server.close()
+        for writer in list(self.clients):
+            self.drop(writer)
+        tasks.cancel()
+
+def run_threaded(host, port, backlog, collector, protocol, delta, reuse_port=False):
+    '''Original server, one thread per client'''
     # Create socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
+    if reuse_port:
+        # several worker processes listen on the same port, the kernel spreads connections over them
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
     try:
         # Bind to address and port
-        server_socket.bind((HOST, PORT))
-        server_socket.listen(5)  # Allow up to 5 connections
-        print('Server listening on {}:{}'.format(HOST, PORT))
+        server_socket.bind((host, port))
+        server_socket.listen(backlog)
+        print('Server listening on {}:{}'.format(host, port))
         print('Waiting for connections...')
         
         while True:
@@ -117,17 +994,448 @@ def main():
             # Handle client in a separate thread
             client_thread = threading.Thread(
                 target=handle_client,
-                args=(client_socket, address)
+                args=(client_socket, address, collector, protocol, delta)
             )
             client_thread.daemon = True
             client_thread.start()
-            
+    finally:
+        server_socket.close()
+
+# --udp: every tick goes out as one datagram to a broadcast or multicast address, the bin record
+# followed by an LG record per gpu (one for the count on fewer) and the LP record (zeros without --sample-rate).
+# no connections, no per display cost, the picos (C_TRANSPORT = 'udp') drop anything older than what they already have by its seq.
+UDP_PORT = 9003
+# multicast stays on the local network
+UDP_TTL = 1
+
+class UdpSender(threading.Thread):
+    '''Sends each snapshot from source (Collector, RelayCollector...) as one datagram'''
+    def __init__(self, source, host, port=UDP_PORT):
+        super().__init__(daemon=True)
+        self.source = source
+        self.address = (host, port)
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if ipaddress.ip_address(host).is_multicast:
+            self.udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, UDP_TTL)
+        else:
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def run(self):
+        seq = 0
+        error = None
+        while True:
+            seq, snapshot = self.source.wait_snapshot(seq)
+            started = time.perf_counter()
+            data = pack_record(snapshot, seq) + pack_gpu_records(snapshot) + pack_peak_record(snapshot)
+            try:
+                self.udp_socket.sendto(data, self.address)
+                error = None
+            except OSError as e:
+                # eg network down, keep trying every tick but only say so once
+                if str(e) != error:
+                    print('UDP send error:', e)
+                    error = str(e)
+            if STATS is not None:
+                STATS.timing('udp send').add(time.perf_counter() - started)
+
+# shared memory snapshot for --workers: an 8 byte sequence number, a 4 byte length, then the
+# snapshot as json. the sequence is odd while the collector is writing (a seqlock), so readers
+# just retry if it was odd or changed while they were copying.
+SHM_SIZE = 64 * 1024
+SHM_HEADER = struct.Struct('<QI')
+
+class SharedSnapshotWriter:
+    '''Publishes every collector tick into shared memory for the worker processes'''
+    def __init__(self):
+        self.shm = shared_memory.SharedMemory(create=True, size=SHM_SIZE)
+        self.seq = 0
+        SHM_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+
+    def publish(self, snapshot):
+        started = time.perf_counter()
+        payload = json.dumps(snapshot, separators=(',', ':')).encode()
+        if SHM_HEADER.size + len(payload) > SHM_SIZE:
+            print('Snapshot too big for shared memory:', len(payload))
+            return
+        buf = self.shm.buf
+        self.seq += 1
+        SHM_HEADER.pack_into(buf, 0, self.seq, 0)  # odd, write in progress
+        buf[SHM_HEADER.size:SHM_HEADER.size + len(payload)] = payload
+        self.seq += 1
+        SHM_HEADER.pack_into(buf, 0, self.seq, len(payload))
+        if STATS is not None:
+            STATS.timing('shared memory publish').add(time.perf_counter() - started)
+
+    def run(self, collector):
+        seq = 0
+        while True:
+            seq, snapshot = collector.wait_snapshot(seq)
+            self.publish(snapshot)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+class SharedSnapshotReader(threading.Thread):
+    '''
+    Worker side of the shared snapshot. One thread per worker polls the seqlock and hands each
+    new snapshot on through a Condition, so it has the same wait_snapshot() as Collector and
+    however many clients are waiting only this thread wakes up every poll.
+    '''
+    def __init__(self, name, poll=0.01):
+        super().__init__(daemon=True)
+        # workers share the main process's resource tracker, so attaching doesn't
+        # add anything it will try to clean up, the main process unlinks it
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.poll = poll
+        self.seq = 0
+        self.snapshot = {}
+        self.cond = threading.Condition()
+
+    def read(self):
+        '''Return (seq, snapshot) if there's a consistent snapshot newer than ours, else None'''
+        buf = self.shm.buf
+        seq, length = SHM_HEADER.unpack_from(buf, 0)
+        if seq & 1 or seq == self.seq:
+            return None
+        payload = bytes(buf[SHM_HEADER.size:SHM_HEADER.size + length])
+        if SHM_HEADER.unpack_from(buf, 0)[0] != seq:
+            # overwritten while copying
+            return None
+        return seq, json.loads(payload)
+
+    def run(self):
+        while True:
+            result = self.read()
+            if result is not None:
+                with self.cond:
+                    # seq and snapshot change together, under the lock
+                    self.seq, self.snapshot = result
+                    self.cond.notify_all()
+            time.sleep(self.poll)
+
+    def wait_snapshot(self, last_seq, timeout=None):
+        '''Block until a snapshot newer than last_seq is published, returns (seq, snapshot)'''
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq, self.snapshot
+
+# --relay: host in the snapshot is 1.. for the peer being shown, RELAY_SUMMARY for all of them merged
+RELAY_SUMMARY = 255
+# a peer that's sent nothing for this long is left out until it comes back (same as the pico's link timeout)
+PEER_TIMEOUT = 15.0
+PEER_RETRY = 5.0
+
+class Peer(threading.Thread):
+    '''
+    One persistent connection to another pc_server, for --relay. Asks for frames and keeps the
+    latest values; however many displays are on the relay the peer only ever has this client.
+    '''
+    def __init__(self, host, port):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.values = {}
+        self.last = None
+
+    def latest(self):
+        '''Copy of the peer's latest values, None if it has gone quiet'''
+        with self.lock:
+            if self.last is None or time.monotonic() - self.last > PEER_TIMEOUT:
+                return None
+            return {key: list(map(list, value)) if key == 'gpus' else value for key, value in self.values.items()}
+
+    def run(self):
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=5.0) as peer_socket:
+                    print('Relay connected to {}:{}'.format(self.host, self.port))
+                    peer_socket.sendall('hello:{}:frame\r\n'.format(PROTOCOL_VERSION).encode())
+                    peer_socket.settimeout(PEER_TIMEOUT)
+                    received = b''
+                    while True:
+                        data = peer_socket.recv(4096)
+                        if not data:
+                            raise ConnectionError('closed by peer')
+                        received += data
+                        lines = received.split(b'\n')
+                        received = lines.pop()[-1024:]
+                        with self.lock:
+                            for line in lines:
+                                parse_frame(line.decode(errors='replace').strip(), self.values)
+                            self.last = time.monotonic()
+            except OSError as e:
+                print('Relay peer {}:{} error: {}'.format(self.host, self.port, e))
+            if STATS is not None: STATS.count('peer reconnects')
+            time.sleep(PEER_RETRY)
+
+def merge_snapshots(snapshots):
+    '''One snapshot for a whole rack: cpu and gpu averaged, everything else added up'''
+    merged = {metric.key: metric.default for metric in METRICS}
+    if not snapshots:
+        return merged
+    for key in ('ram', 'ram_total', 'disk', 'disk_read', 'disk_write', 'net_rx', 'net_tx', 'vram', 'vram_total'):
+        merged[key] = sum(snapshot.get(key, 0) for snapshot in snapshots)
+    merged['ram'] = round(merged['ram'], 1)
+    merged['ram_total'] = round(merged['ram_total'], 1)
+    merged['cpu'] = round(sum(snapshot.get('cpu', 0) for snapshot in snapshots) / len(snapshots))
+    gpus = []
+    for snapshot in snapshots:
+        if snapshot.get('gpus'):
+            gpus.extend(snapshot['gpus'])
+        elif snapshot.get('vram_total'):
+            # a one gpu peer only sends its totals
+            gpus.append([snapshot.get('gpu', 0), snapshot.get('vram', 0), snapshot['vram_total']])
+    if gpus:
+        merged['gpu'] = round(sum(gpu[0] for gpu in gpus) / len(gpus))
+    merged['gpus'] = gpus[:MAX_GPUS]
+    return merged
+
+class RelayCollector(threading.Thread):
+    '''
+    Snapshot source for --relay, same wait_snapshot() as Collector. Each tick it publishes either
+    the next peer in turn (view 'cycle', changing every `cycle` seconds) or all of them merged
+    ('summary'). host in the snapshot says which, for the display.
+    '''
+    def __init__(self, peers, view='cycle', cycle=5.0, tick=0.25):
+        super().__init__(daemon=True)
+        self.peers = [Peer(host, port) for host, port in peers]
+        self.view = view
+        self.cycle = cycle
+        self.tick = tick
+        self.seq = 0
+        self.snapshot = {}
+        self.cond = threading.Condition()
+
+    def sample(self):
+        live = [(i, values) for i, values in ((i, peer.latest()) for i, peer in enumerate(self.peers)) if values is not None]
+        if self.view == 'summary':
+            snapshot = merge_snapshots([values for i, values in live])
+            snapshot['host'] = RELAY_SUMMARY if live else 0
+        else:
+            snapshot = {metric.key: metric.default for metric in METRICS}
+            snapshot['host'] = 0
+            if live:
+                i, values = live[int(time.monotonic() / self.cycle) % len(live)]
+                snapshot.update(values)
+                snapshot['host'] = i + 1
+        snapshot['time'] = time.time()
+        return snapshot
+
+    def run(self):
+        for peer in self.peers:
+            peer.start()
+        while True:
+            start = time.monotonic()
+            snapshot = self.sample()
+            with self.cond:
+                self.snapshot = snapshot
+                self.seq += 1
+                self.cond.notify_all()
+            delay = self.tick - (time.monotonic() - start)
+            if delay > 0: time.sleep(delay)
+
+    def wait_snapshot(self, last_seq, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq, self.snapshot
+
+def parse_address(text, port=9002):
+    '''host[:port] for --relay and --udp'''
+    host, _, text_port = text.rpartition(':')
+    if not host:
+        return text, port
+    return host, int(text_port)
+
+def serve_stats(port):
+    '''Stats port for --stats, every connection gets one report and is closed (eg nc 127.0.0.1 9003)'''
+    stats_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    stats_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # local only, it says who is connected
+    stats_socket.bind(('127.0.0.1', port))
+    stats_socket.listen(4)
+    while True:
+        client_socket, _ = stats_socket.accept()
+        try:
+            client_socket.sendall(STATS.report().encode())
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+def dump_stats(signum, frame):
+    print(STATS.report(), flush=True)
+
+def serve(args, source, reuse_port=False):
+    '''Run the server selected by args, fed from a Collector or SharedSnapshotReader'''
+    if args.mode == 'asyncio':
+        asyncio.run(AsyncServer(source, args.protocol, args.delta).serve(args.host, args.port, args.backlog, reuse_port))
+    else:
+        run_threaded(args.host, args.port, args.backlog, source, args.protocol, args.delta, reuse_port)
+
+def stop_server(signum, frame):
+    '''
+    SIGTERM/SIGHUP (systemd, tmux, a cron restart) stop the threaded server the same way ctrl-c
+    does. AsyncServer.serve replaces it with AsyncServer.stop
+    '''
+    raise SystemExit(0)
+
+def watch_parent(parent, poll=1.0):
+    '''A worker whose main process has gone (killed with no chance to stop it) exits too, rather than keep the port'''
+    while os.getppid() == parent:
+        time.sleep(poll)
+    print('Worker {}: main process gone, exiting'.format(os.getpid()), flush=True)
+    os._exit(0)
+
+def worker_main(args, shm_name, parent):
+    '''Entry point for a --workers process, serves from the shared snapshot'''
+    threading.Thread(target=watch_parent, args=(parent,), daemon=True).start()
+    try:
+        reader = SharedSnapshotReader(shm_name)
+        reader.start()
+        serve(args, reader, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve pc stats to the pico display')
+    parser.add_argument('--host', default='192.168.1.201', help='address to listen on (default: 192.168.1.201)')
+    parser.add_argument('--port', type=int, default=9002, help='port to listen on (default: 9002)')
+    parser.add_argument('--backlog', type=int, default=128, help='listen backlog (default: 128)')
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded',
+                        help='threaded: a thread per client, asyncio: one event loop for hundreds of clients')
+    parser.add_argument('--protocol', choices=PROTOCOLS, default='lines',
+                        help='default protocol until a client asks for another, lines: one metric per tick (old picos), '
+                             'frame: all metrics every tick, bin: binary record every tick')
+    parser.add_argument('--delta', action='store_true',
+                        help='frame/bin clients only get metrics that changed, plus a full update every {:g}s'.format(HEARTBEAT))
+    parser.add_argument('--workers', type=int, default=0,
+                        help='serve from this many processes sharing the port (SO_REUSEPORT), '
+                             'sampling still happens once in the main process (default: 0, serve in this process)')
+    parser.add_argument('--stats', type=int, nargs='?', const=0, default=None, metavar='PORT',
+                        help='collect timings and per client counters, printed on SIGUSR1 (each worker prints its own), '
+                             'and with a port also served on 127.0.0.1:PORT')
+    parser.add_argument('--timestamps', action='store_true',
+                        help='add sample and send timestamps to frames, for emu.latency')
+    parser.add_argument('--gpu', choices=gpu_provider.PROVIDER_NAMES, default='auto',
+                        help='gpu telemetry backend (default: auto)')
+    parser.add_argument('--sample-rate', type=float, default=0, metavar='HZ',
+                        help='sample cpu, disk, gpu and network this many times a second and send the mean over '
+                             '--window, plus its peaks, instead of single samples (eg 20, default: off)')
+    parser.add_argument('--window', type=float, default=1.0,
+                        help='seconds of samples behind each mean/min/max/p95 with --sample-rate (default: 1)')
+    parser.add_argument('--udp', metavar='ADDRESS[:PORT]',
+                        help='also send every tick as one datagram to this broadcast or multicast address '
+                             '(eg 192.168.1.255 or 239.0.0.90, port {} by default)'.format(UDP_PORT))
+    parser.add_argument('--relay', nargs='+', metavar='HOST[:PORT]',
+                        help='relay mode: serve other pc_servers instead of this machine, one connection to each')
+    parser.add_argument('--relay-view', choices=('cycle', 'summary'), default='cycle',
+                        help='cycle: one peer at a time, summary: all peers merged (default: cycle)')
+    parser.add_argument('--relay-cycle', type=float, default=5.0,
+                        help='seconds on each peer for --relay-view cycle (default: 5)')
+    parser.add_argument('--record', metavar='FILE',
+                        help='append every tick to this recording, rotated to FILE.1, FILE.2... (see recording.py)')
+    parser.add_argument('--record-size', type=float, default=16, metavar='MB',
+                        help='rotate the recording when it gets to this size (default: 16)')
+    parser.add_argument('--record-keep', type=int, default=3,
+                        help='rotated recordings to keep (default: 3)')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='serve a recording (with its rotated FILE.n before it) instead of this machine')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='X',
+                        help='replay this many times faster than recorded (default: 1)')
+    parser.add_argument('--replay-loop', action='store_true',
+                        help='start the replay again when it ends')
+    args = parser.parse_args()
+
+    if args.udp:
+        # a name (eg bcast.lan) is looked up once here, the sender wants an address to tell
+        # broadcast from multicast
+        try:
+            udp_host, udp_port = parse_address(args.udp, UDP_PORT)
+            udp_host = socket.gethostbyname(udp_host)
+        except (OSError, ValueError) as e:
+            parser.error('--udp {}: {}'.format(args.udp, e))
+
+    global TIMESTAMPS, STATS
+    TIMESTAMPS = args.timestamps
+    if args.stats is not None:
+        STATS = Stats()
+        # set up before the workers fork so they get it too
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, dump_stats)
+    # the finally at the end has to run however we're stopped, or the workers are left serving
+    for name in ('SIGTERM', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), stop_server)
+
+    shared = None
+    workers = []
+    if args.workers > 0:
+        # start the workers before any threads exist, forking with threads running is asking for trouble.
+        # fork, not the platform default (forkserver on linux from python 3.14), the workers rely on
+        # inheriting STATS, TIMESTAMPS and the signal handlers
+        context = multiprocessing.get_context('fork')
+        shared = SharedSnapshotWriter()
+        for i in range(args.workers):
+            worker = context.Process(target=worker_main, args=(args, shared.shm.name, os.getpid()), daemon=True)
+            worker.start()
+            workers.append(worker)
+        print('Started {} workers'.format(args.workers))
+
+    # one sampler shared by every client
+    gpu = None
+    if args.replay:
+        files = recording.rotated_files(args.replay)
+        if not files:
+            sys.exit('No recording at ' + args.replay)
+        print('Replaying', ', '.join(files), 'at {:g}x'.format(args.replay_speed))
+        collector = recording.ReplaySource(files, args.replay_speed, args.replay_loop)
+    elif args.relay:
+        peers = [parse_address(peer) for peer in args.relay]
+        print('Relaying', ', '.join('{}:{}'.format(*peer) for peer in peers), '({})'.format(args.relay_view))
+        collector = RelayCollector(peers, args.relay_view, args.relay_cycle)
+    else:
+        sample_tick = 1.0 / args.sample_rate if args.sample_rate > 0 else None
+        gpu = gpu_provider.get_provider(args.gpu, sample_tick or 0.25)
+        print('GPU provider:', gpu.name)
+        collector = Collector(gpu, sample_tick=sample_tick, window=args.window)
+        if sample_tick:
+            print('Sampling at {:g}Hz, {:g}s windows ({})'.format(
+                args.sample_rate, args.window, 'numpy' if numpy is not None else 'no numpy'))
+    collector.start()
+    recorder = None
+    if args.record:
+        recorder = recording.Recorder(args.record, int(args.record_size * 1024 * 1024), args.record_keep, MAX_GPUS)
+        threading.Thread(target=recorder.run, args=(collector,), daemon=True).start()
+        print('Recording to', args.record)
+    if args.udp:
+        UdpSender(collector, udp_host, udp_port).start()
+        print('Sending udp to {}:{}'.format(udp_host, udp_port))
+    if args.stats:
+        threading.Thread(target=serve_stats, args=(args.stats,), daemon=True).start()
+        print('Stats on 127.0.0.1:{}'.format(args.stats))
+
+    try:
+        if shared is not None:
+            shared.run(collector)
+        else:
+            serve(args, collector)
     except KeyboardInterrupt:
         print('\nServer stopping...')
     except Exception as e:
         print('Server error:', e)
     finally:
-        server_socket.close()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join(2)
+        if shared is not None:
+            shared.close()
+        if gpu is not None:
+            gpu.close()
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,270 @@
+# recording.py
+# record pc_server snapshots to disk and play them back, used by pc_server.py --record / --replay.
+#
+# file layout: a 512 byte header then fixed size records, so a file can be mmapped and record n
+# is just at HEADER_SIZE + n * record size (numpy.memmap works too, see Recording.dtype).
+#   header: magic 'LCRC', format version (u16), field count (u16), record size (u32), then the
+#           fields as 'name:kind' joined by ',' (kind i or f), zero padded
+#   record: sample time (float64, unix seconds), then a float32 per field. NaN means the
+#           snapshot didn't have that key (eg no peaks without --sample-rate)
+# a file never grows past max_bytes, it's rotated to name.1, name.2... keeping `keep` old ones.
+#
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'LCRC'
+FORMAT_VERSION = 1
+HEADER_SIZE = 512
+HEADER = struct.Struct('<4sHHI')
+
+# snapshot keys recorded, i are rounded back to ints on replay
+FIELDS = (
+    ('cpu', 'i'), ('ram', 'f'), ('ram_total', 'f'), ('disk', 'i'), ('disk_read', 'i'), ('disk_write', 'i'),
+    ('net_rx', 'i'), ('net_tx', 'i'), ('gpu', 'i'), ('vram', 'i'), ('vram_total', 'i'), ('host', 'i'),
+    ('cpu_max', 'i'), ('gpu_max', 'i'), ('disk_max', 'i'),
+)
+# a gap longer than this in a recording (server was down) is cut short on replay
+MAX_GAP = 5.0
+
+
+def make_fields(max_gpus):
+    '''FIELDS plus the gpu count and util/used/total for each of max_gpus cards'''
+    fields = list(FIELDS) + [('gpu_count', 'i')]
+    for i in range(max_gpus):
+        fields += [('g{}_util'.format(i), 'i'), ('g{}_used'.format(i), 'i'), ('g{}_total'.format(i), 'i')]
+    return tuple(fields)
+
+
+def make_header(fields):
+    names = ','.join('{}:{}'.format(name, kind) for name, kind in fields).encode()
+    record_size = 8 + 4 * len(fields)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(fields), record_size) + names
+    if len(header) > HEADER_SIZE:
+        raise ValueError('too many fields for the recording header')
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(data):
+    '''Return (fields, record size) from the start of a recording'''
+    magic, version, count, record_size = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('not a recording (or a newer format)')
+    names = bytes(data[HEADER.size:HEADER_SIZE]).rstrip(b'\0').decode()
+    fields = tuple(tuple(field.split(':')) for field in names.split(','))
+    if len(fields) != count:
+        raise ValueError('broken recording header')
+    return fields, record_size
+
+
+class Recorder:
+    '''Appends snapshots to path, rotating it when it would go past max_bytes'''
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, keep=3, max_gpus=8):
+        self.path = path
+        self.fields = make_fields(max_gpus)
+        self.header = make_header(self.fields)
+        self.record = struct.Struct('<d{}f'.format(len(self.fields)))
+        # at least the header and one record
+        self.max_bytes = max(max_bytes, HEADER_SIZE + self.record.size)
+        self.keep = keep
+        self.file = None
+        self.size = 0
+        self.open()
+
+    def open(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                same = f.read(HEADER_SIZE) == self.header
+            if not same:
+                # something else, or recorded with other fields, keep it but don't append to it
+                self.rotate()
+        self.file = open(self.path, 'ab', buffering=0)
+        self.size = self.file.tell()
+        if self.size == 0:
+            self.file.write(self.header)
+            self.size = HEADER_SIZE
+        else:
+            # drop a record cut short by a crash, so everything after it lines up
+            whole = HEADER_SIZE + (self.size - HEADER_SIZE) // self.record.size * self.record.size
+            if whole != self.size:
+                self.file.truncate(whole)
+                self.size = whole
+
+    def rotate(self):
+        '''name -> name.1 -> name.2..., the oldest past keep is deleted'''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        oldest = '{}.{}'.format(self.path, self.keep) if self.keep else self.path
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for i in range(self.keep, 0, -1):
+            newer = '{}.{}'.format(self.path, i - 1) if i > 1 else self.path
+            if os.path.exists(newer):
+                os.replace(newer, '{}.{}'.format(self.path, i))
+
+    def values(self, snapshot):
+        gpus = snapshot.get('gpus') or ()
+        values = []
+        for name, kind in self.fields:
+            if name == 'gpu_count':
+                value = len(gpus)
+            elif name[0] == 'g' and name[1].isdigit():
+                index, _, part = name[1:].partition('_')
+                index = int(index)
+                value = gpus[index][('util', 'used', 'total').index(part)] if index < len(gpus) else None
+            else:
+                value = snapshot.get(name)
+            values.append(math.nan if value is None else float(value))
+        return values
+
+    def write(self, snapshot):
+        if self.size + self.record.size > self.max_bytes:
+            self.rotate()
+            self.open()
+        self.file.write(self.record.pack(snapshot.get('time', time.time()), *self.values(snapshot)))
+        self.size += self.record.size
+
+    def run(self, source):
+        '''Record every snapshot source (Collector, RelayCollector...) publishes'''
+        seq = 0
+        while True:
+            seq, snapshot = source.wait_snapshot(seq)
+            try:
+                self.write(snapshot)
+            except OSError as e:
+                print('Recorder error:', e)
+                time.sleep(1)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class Recording:
+    '''
+    A recording opened read only through mmap, recording[n] is (time, snapshot).
+    Safe to open while it's still being recorded, it only sees the records there when opened.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                # empty (a recorder that died before its header) can't even be mmapped
+                raise ValueError('not a recording (too short)')
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.fields, self.record_size = read_header(self.map)
+        self.record = struct.Struct('<d{}f'.format(len(self.fields)))
+        if self.record.size != self.record_size:
+            raise ValueError('broken recording header')
+        self.count = (len(self.map) - HEADER_SIZE) // self.record_size
+
+    def dtype(self):
+        '''numpy dtype of a record, for numpy.memmap(path, dtype, offset=HEADER_SIZE)'''
+        return [('time', '<f8')] + [(name, '<f4') for name, kind in self.fields]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, n):
+        if not 0 <= n < self.count:
+            raise IndexError(n)
+        values = self.record.unpack_from(self.map, HEADER_SIZE + n * self.record_size)
+        snapshot = {}
+        gpus = []
+        for (name, kind), value in zip(self.fields, values[1:]):
+            if math.isnan(value):
+                continue
+            value = int(round(value)) if kind == 'i' else round(value, 1)
+            if name[0] == 'g' and name[1].isdigit():
+                index = int(name[1:].partition('_')[0])
+                while len(gpus) <= index:
+                    gpus.append([0, 0, 0])
+                gpus[index][('util', 'used', 'total').index(name.partition('_')[2])] = value
+            else:
+                snapshot[name] = value
+        snapshot['gpus'] = gpus[:snapshot.pop('gpu_count', len(gpus))]
+        snapshot['disks'] = {}
+        return values[0], snapshot
+
+    def close(self):
+        self.map.close()
+
+
+def rotated_files(path):
+    '''path and its rotated copies that exist, oldest first'''
+    files = []
+    i = 1
+    while os.path.exists('{}.{}'.format(path, i)):
+        files.insert(0, '{}.{}'.format(path, i))
+        i += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+class ReplaySource(threading.Thread):
+    '''
+    Plays recordings back with the same wait_snapshot() as pc_server's Collector, so the servers
+    can't tell the difference. speed 2 is twice as fast. Gaps longer than MAX_GAP are cut short.
+    '''
+    def __init__(self, paths, speed=1.0, loop=False):
+        super().__init__(daemon=True)
+        self.paths = paths
+        self.speed = speed
+        self.loop = loop
+        self.seq = 0
+        self.snapshot = {}
+        self.cond = threading.Condition()
+
+    def publish(self, snapshot):
+        with self.cond:
+            self.snapshot = snapshot
+            self.seq += 1
+            self.cond.notify_all()
+
+    def play(self):
+        '''Play every file once, returns how many snapshots went out'''
+        played = 0
+        last_time = None
+        due = time.monotonic()
+        for path in self.paths:
+            try:
+                recording = Recording(path)
+            except (OSError, ValueError) as e:
+                print('Replay skipping {}: {}'.format(path, e))
+                continue
+            try:
+                for n in range(len(recording)):
+                    recorded, snapshot = recording[n]
+                    if last_time is not None:
+                        due += min(max(recorded - last_time, 0.0), MAX_GAP) / self.speed
+                    last_time = recorded
+                    delay = due - time.monotonic()
+                    if delay > 0: time.sleep(delay)
+                    snapshot['recorded'] = recorded
+                    # now, so lag and latency figures still mean something
+                    snapshot['time'] = time.time()
+                    self.publish(snapshot)
+                    played += 1
+            finally:
+                recording.close()
+        return played
+
+    def run(self):
+        while True:
+            if not self.play():
+                print('Nothing to replay')
+                return
+            if not self.loop:
+                print('Replay finished')
+                return
+            print('Replay starting again')
+
+    def wait_snapshot(self, last_seq, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout)
+            return self.seq, self.snapshot
@@ -1,6 +1,7 @@
 # MicroPython SSD1306 OLED driver, I2C and SPI interfaces
 
 from micropython import const
+import micropython
 import framebuf
 
 
@@ -32,10 +33,15 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        self.buffer_mv = memoryview(self.buffer)
+        # what the panel holds since the last show, so show() can send only what changed
+        self.shadow = bytearray(self.pages * self.width)
+        self.shadow_valid = False
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
     def init_display(self):
+        self.shadow_valid = False
         for cmd in (
             SET_DISP | 0x00,  # off
             # address setting
@@ -85,20 +91,71 @@ class SSD1306(framebuf.FrameBuffer):
     def invert(self, invert):
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
-    def show(self):
+    def show(self, full=False):
+        # Only send what changed since the last show: each page (8 pixel rows) is diffed
+        # against the shadow copy, and each run of dirty pages goes out as one window
+        # covering their changed columns. full=True sends the whole buffer.
+        if full or not self.shadow_valid:
+            self.write_window(0, self.width - 1, 0, self.pages - 1)
+            self.shadow[:] = self.buffer
+            self.shadow_valid = True
+            return
+
+        run_start = -1
+        run_x0 = 0
+        run_x1 = 0
+        for page in range(self.pages):
+            dirty, x0, x1 = self.dirty_columns(page * self.width, self.width)
+            if dirty:
+                if run_start < 0:
+                    run_start = page
+                    run_x0 = x0
+                    run_x1 = x1
+                else:
+                    if x0 < run_x0: run_x0 = x0
+                    if x1 > run_x1: run_x1 = x1
+            elif run_start >= 0:
+                self.write_window(run_x0, run_x1, run_start, page - 1)
+                run_start = -1
+        if run_start >= 0:
+            self.write_window(run_x0, run_x1, run_start, self.pages - 1)
+
+    @micropython.native
+    def dirty_columns(self, start, width):
+        # returns (dirty, first changed column, last changed column) for one page
+        buf = self.buffer
+        shadow = self.shadow
         x0 = 0
-        x1 = self.width - 1
-        if self.width == 64:
-            # displays with width of 64 pixels are shifted by 32
-            x0 += 32
-            x1 += 32
+        while x0 < width and buf[start + x0] == shadow[start + x0]:
+            x0 += 1
+        if x0 == width:
+            return False, 0, 0
+        x1 = width - 1
+        while buf[start + x1] == shadow[start + x1]:
+            x1 -= 1
+        return True, x0, x1
+
+    def write_window(self, x0, x1, page0, page1):
+        # send columns x0..x1 of pages page0..page1 and update the shadow to match
+        offset = 32 if self.width == 64 else 0  # displays with width of 64 pixels are shifted by 32
         self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
+        self.write_cmd(x0 + offset)
+        self.write_cmd(x1 + offset)
         self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        self.write_cmd(page0)
+        self.write_cmd(page1)
+        if x0 == 0 and x1 == self.width - 1:
+            # full width pages are contiguous in the buffer
+            start = page0 * self.width
+            end = (page1 + 1) * self.width
+            self.write_data(self.buffer_mv[start:end])
+            self.shadow[start:end] = self.buffer_mv[start:end]
+            return
+        for page in range(page0, page1 + 1):
+            start = page * self.width + x0
+            end = page * self.width + x1 + 1
+            self.write_data(self.buffer_mv[start:end])
+            self.shadow[start:end] = self.buffer_mv[start:end]
 
 
 class SSD1306_I2C(SSD1306):